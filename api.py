@@ -1,31 +1,203 @@
 import logging
 import requests
 from dotenv import load_dotenv
-import os, io
+import os
+import shutil
 import random
 import string
 import uuid
-from PIL import Image
 import time
-import replicate
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from generation_cache import GenerationCache, file_sha256
+from downloads import DownloadError, stream_download
+from image_codec import save_image_bytes
+from retry_policy import RetryPolicy
+from warmup import ModelWarmer
+from hedging import HedgeStats, LatencyTracker, run_hedged
+import metrics
+from singleflight import SingleFlight
+from preprocess import InputPreparer
+from asset_store import AssetStore
+from model_registry import ModelRegistry
 
 
 load_dotenv()
 
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
 
 # URLs for various Hugging Face models (Stability AI, Boreal, Flux, and Phantasma Anime)
-stability_api_url = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
-boreal_api_url = "https://api-inference.huggingface.co/models/kudzueye/Boreal"
-flux_api_url = "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-dev"
-phantasma_anime_api_url = "https://api-inference.huggingface.co/models/alvdansen/phantasma-anime"
+# HF_INFERENCE_BASE_URL can point these at a local stand-in, e.g. stub_servers.py for benchmarks
+hf_inference_base_url = os.getenv("HF_INFERENCE_BASE_URL", "https://api-inference.huggingface.co")
+stability_api_url = f"{hf_inference_base_url}/models/stabilityai/stable-diffusion-xl-base-1.0"
+boreal_api_url = f"{hf_inference_base_url}/models/kudzueye/Boreal"
+flux_api_url = f"{hf_inference_base_url}/models/black-forest-labs/FLUX.1-dev"
+phantasma_anime_api_url = f"{hf_inference_base_url}/models/alvdansen/phantasma-anime"
+
+# Map generator names to their Hugging Face inference endpoints
+generator_urls = {
+    "flux": flux_api_url,
+    "stability": stability_api_url,
+    "boreal": boreal_api_url,
+    "phantasma-anime": phantasma_anime_api_url,
+}
+
+# Reverse lookup used to label per-request metrics with the generator name
+generator_names = {url: name for name, url in generator_urls.items()}
 
 # Prepare headers for API requests to Hugging Face, including the authorization token
 hf_headers = {"Authorization": f"Bearer {api_token}"}
 
+# Shared HTTP session so repeated requests reuse keep-alive connections
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=len(generator_urls), pool_maxsize=32))
+http_session.mount("http://", HTTPAdapter(pool_connections=len(generator_urls), pool_maxsize=32))
+
+# Retry behaviour for Hugging Face requests, tuned for models that need to load after being idle
+hf_retry_policy = RetryPolicy(
+    max_attempts=int(os.getenv("HF_MAX_ATTEMPTS", "6")),
+    max_total_wait=float(os.getenv("HF_MAX_RETRY_WAIT", "180"))
+)
+
+# Connect and read timeouts for Hugging Face requests, in seconds
+hf_timeout = (float(os.getenv("HF_CONNECT_TIMEOUT", "5")), float(os.getenv("HF_READ_TIMEOUT", "120")))
+
+# Hedging: once a request runs past this latency percentile of its generator, race a fallback
+hedge_percentile = float(os.getenv("HEDGE_PERCENTILE", "95"))
+hedge_default_deadline = float(os.getenv("HEDGE_DEFAULT_DEADLINE", "30"))
+# Fallback generator per generator as "flux:stability,boreal:flux"; unlisted generators retry themselves
+hedge_fallbacks = {
+    name.strip(): fallback.strip()
+    for name, fallback in (pair.split(":", 1) for pair in os.getenv("HEDGE_FALLBACKS", "").split(",") if ":" in pair)
+    if fallback.strip() in generator_urls
+}
+hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+latency_tracker = LatencyTracker()
+hedge_stats = HedgeStats()
+
+# Identical upscale/video requests that arrive while one is running share its prediction
+inflight_predictions = SingleFlight()
+
+# Output format for generated images: "png", "webp" (lossless) or "native" to keep the API's format
+output_codec = os.getenv("OUTPUT_CODEC", "png")
+# Only used when a non-PNG payload is re-encoded to PNG; PNG payloads are written unchanged
+png_compress_level = int(os.getenv("OUTPUT_PNG_COMPRESS_LEVEL", "6"))
+
+# Largest Replicate output we are willing to download
+max_download_bytes = int(os.getenv("MAX_DOWNLOAD_BYTES", str(512 * 1024 ** 2)))
+
+# Cap on in-flight requests per generator backend, shared by every caller in the process
+max_concurrency_per_generator = int(os.getenv("MAX_CONCURRENCY_PER_GENERATOR", "2"))
+generator_semaphores = {
+    name: threading.BoundedSemaphore(max_concurrency_per_generator) for name in generator_urls
+}
+
+# Replicate model versions and the inputs sent with every prediction
+upscale_model_version = "507ddf6f977a7e30e46c0daefd30de7d563c72322f9e4cf7cbac52ef0f667b13"
+upscale_params = {
+    "hdr": 0,
+    "steps": 20,
+    "prompt": "UHD 4k",
+    "scheduler": "DDIM",
+    "creativity": 0.25,
+    "guess_mode": False,
+    "resolution": "original",
+    "resemblance": 0.75,
+    "guidance_scale": 7,
+    "negative_prompt": "teeth, tooth, open mouth, longbody, lowres, bad anatomy, bad hands, missing fingers, extra digit, fewer digits, cropped, worst quality, low quality, mutant"
+}
+
+video_model_name = "sunfjun/stable-video-diffusion"
+video_model_version = "d68b6e09eedbac7a49e3d8644999d93579c386a083768235cabca88796d70d82"
+video_params = {
+    "cond_aug": 0.05,
+    "decoding_t": 14,
+    "video_length": "14_frames_with_svd",
+    "sizing_strategy": "maintain_aspect_ratio",
+    "motion_bucket_id": 127,
+    "frames_per_second": 6
+}
+
+# stable-video-diffusion resizes and crops its input to 1024x576 unless told to keep the input size
+video_input_size = None if video_params["sizing_strategy"] == "use_image_dimensions" else (1024, 576)
+
+# On-disk cache used by deterministic mode to return repeated work without calling the APIs
+generation_cache = GenerationCache(
+    cache_dir=os.getenv("GENERATION_CACHE_DIR", os.path.join("static", "cache")),
+    max_bytes=int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+)
+
+# Uploads and outputs are stored once per content hash and hard-linked into session directories
+asset_store = AssetStore(os.getenv("ASSET_STORE_DIR", os.path.join("static", "assets")))
+
+# Connections kept open by the shared Replicate client
+replicate_max_connections = int(os.getenv("REPLICATE_MAX_CONNECTIONS", "16"))
+
+
+def _build_replicate_client():
+    """One Replicate client for all calls, so uploads, predictions and polling reuse pooled connections"""
+    import httpx
+    import replicate
+
+    limits = httpx.Limits(
+        max_connections=replicate_max_connections, max_keepalive_connections=replicate_max_connections
+    )
+    return replicate.Client(transport=httpx.HTTPTransport(limits=limits))
+
+
+# Model version handles are looked up once per REPLICATE_MODEL_TTL seconds instead of on every video
+model_registry = ModelRegistry(
+    _build_replicate_client, ttl=float(os.getenv("REPLICATE_MODEL_TTL", "3600"))
+)
+
+# Shrunken copies of input images, so repeated uploads of the same source are prepared once
+input_preparer = InputPreparer(
+    cache_dir=os.getenv("PREPARED_INPUT_DIR", os.path.join(generation_cache.cache_dir, "prepared")),
+    max_bytes=int(os.getenv("PREPARED_INPUT_MAX_BYTES", str(512 * 1024 ** 2)))
+)
+
+def start_model_warmer(generators=None, interval=None):
+    """
+    Start a background warmer for the given generators, defaulting to the comma
+    separated HF_WARM_MODELS setting. Returns the warmer, or None if nothing is selected.
+    """
+    if generators is None:
+        generators = [name.strip() for name in os.getenv("HF_WARM_MODELS", "").split(",") if name.strip()]
+    model_urls = {name: generator_urls[name] for name in generators if name in generator_urls}
+    if not model_urls:
+        return None
+
+    warmer = ModelWarmer(
+        model_urls, http_session, hf_headers,
+        interval=interval or float(os.getenv("HF_WARM_INTERVAL", "300"))
+    )
+    warmer.start()
+    return warmer
+
+
+def prewarm_replicate_models():
+    """Resolve the Replicate model versions in the background so the first video does not wait for it"""
+    return model_registry.prewarm([(video_model_name, video_model_version)])
+
+
+def store_asset(path, sha256=None):
+    """
+    Hand a finished output to the asset store and return its path, which keeps working if that fails.
+    Error results are passed through unchanged.
+    """
+    if path.startswith("error"):
+        return path
+    try:
+        asset_store.adopt(path, sha256)
+    except OSError as e:
+        logger.warning("Error adding %s to the asset store: %s", path, e)
+    return path
+
+
 #uniqe image identifier
 def random_sig():
     """Generates a 3-character random signature, which can be a combination of letters or digits."""
@@ -33,27 +205,52 @@ def random_sig():
 
 
 
-def query_image(prompt, api_url, retries=3, delay=5):
+def query_image(prompt, api_url, retry_policy=None, cancel_event=None):
     """
     Generic function to query a Hugging Face API for generating images based on a prompt.
     The function sends a POST request to the specified API URL with the prompt data.
+    Failed attempts are retried according to retry_policy (hf_retry_policy by default)
+    until cancel_event, if given, is set.
     Returns the binary content of the generated image or None if an error occurred.
     """
-    for attempt in range(retries):
+    retry_policy = retry_policy or hf_retry_policy
+    cancel_event = cancel_event or threading.Event()
+    total_wait = 0.0
+    for attempt in range(retry_policy.max_attempts):
+        if cancel_event.is_set():
+            logger.info("Query to %s cancelled", api_url)
+            return None
+        response = None
         try:
-            logging.info(f"Querying {api_url} with prompt: {prompt}")
-            response = requests.post(api_url, headers=hf_headers, json={"inputs": prompt})
+            # Prompts are only logged at debug level
+            logger.info("Querying %s", api_url)
+            logger.debug("Prompt: %s", prompt)
+            # Stream the response so waiting for the model and receiving the image are timed separately
+            with metrics.timer("network_wait", generator=generator_names.get(api_url, api_url)):
+                response = http_session.post(
+                    api_url, headers=hf_headers, json={"inputs": prompt}, timeout=hf_timeout, stream=True
+                )
             response.raise_for_status()  # Raise an error for bad responses (4xx, 5xx)
-            logging.info(f"Received response with status code {response.status_code}")
-            return response.content  # Return the image content as bytes
+            with metrics.timer("payload_transfer", generator=generator_names.get(api_url, api_url)):
+                content = response.content
+            logger.info("Received response with status code %s", response.status_code)
+            return content  # Return the image content as bytes
         except requests.exceptions.RequestException as e:
-            logging.info(f"Error querying {api_url}: {e}")
-            if attempt < retries - 1:
-                logging.info(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                logging.error("Max retries reached. Failed to generate image.")
-                return None
+            logger.info("Error querying %s: %s", api_url, e)
+
+        delay = retry_policy.delay_for(response, attempt)
+        if delay is None:
+            logger.error("Request failed with a non-retryable error. Failed to generate image.")
+            return None
+        if attempt == retry_policy.max_attempts - 1 or total_wait + delay > retry_policy.max_total_wait:
+            logger.error("Max retries reached. Failed to generate image.")
+            return None
+
+        logger.info("Retrying in %.1f seconds...", delay)
+        if cancel_event.wait(delay):
+            logger.info("Query to %s cancelled", api_url)
+            return None
+        total_wait += delay
 
 
 def query_flux_image(prompt):
@@ -70,209 +267,449 @@ def query_phantasma_anime_image(prompt):
 
 
 
-def generate_image(prompt, generator, session_dir):
+def fetch_image(prompt, generator, cancel_event=None, wait_for_slot=True):
+    """
+    Query a generator under its concurrency cap, recording the latency of successful calls.
+    Without wait_for_slot, returns None at once instead of queueing when the cap is reached.
+    """
+    start = time.monotonic()
+    semaphore = generator_semaphores[generator]
+    if not semaphore.acquire(blocking=wait_for_slot):
+        logger.info("No free %s slot, not sending the request", generator)
+        return None
+    try:
+        # Cancelled while waiting for the slot, e.g. a hedge that already lost
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        image_bytes = query_image(prompt, generator_urls[generator], cancel_event=cancel_event)
+    finally:
+        semaphore.release()
+    if image_bytes:
+        latency_tracker.record(generator, time.monotonic() - start)
+    return image_bytes
+
+
+def _has_free_slot(generator):
+    semaphore = generator_semaphores[generator]
+    if not semaphore.acquire(blocking=False):
+        return False
+    semaphore.release()
+    return True
+
+
+def fetch_image_hedged(prompt, generator):
+    """
+    Query a generator, and if it is slower than its usual latency percentile, send the same
+    prompt to its fallback generator as well and keep whichever answers first.
+    The hedge is skipped when the fallback has no free slot, as it would only queue.
+    Returns (image_bytes, generator that produced them).
+    """
+    fallback = hedge_fallbacks.get(generator, generator)
+    deadline = latency_tracker.percentile(generator, hedge_percentile, default=hedge_default_deadline)
+    image_bytes, winner, hedged = run_hedged(
+        lambda cancel_event: fetch_image(prompt, generator, cancel_event),
+        lambda cancel_event: fetch_image(prompt, fallback, cancel_event, wait_for_slot=False),
+        deadline, hedge_executor, can_hedge=lambda: _has_free_slot(fallback)
+    )
+    hedge_stats.record(generator, hedged, winner)
+    return image_bytes, (fallback if winner == "hedge" else generator)
+
+
+def hedging_report():
+    """Return hedge counters alongside observed p50/p95/p99 latency per generator, for tuning the deadline"""
+    report = hedge_stats.snapshot()
+    for generator in generator_urls:
+        entry = report.setdefault(generator, {})
+        for pct in (50, 95, 99):
+            entry[f"p{pct}_seconds"] = latency_tracker.percentile(generator, pct)
+    return report
+
+
+hedge_gauge = metrics.registry.gauge(
+    "source_studio_hedge", "Hedged image requests per generator: calls, hedged, wins, failures and hedge rate"
+)
+generator_latency_gauge = metrics.registry.gauge(
+    "source_studio_generator_latency_seconds", "Recent image generation latency percentiles per generator"
+)
+generation_cache_gauge = metrics.registry.gauge(
+    "source_studio_generation_cache", "Generation cache hits, misses, evictions and usage"
+)
+
+
+def _collect_stats():
+    """Copy the hedging and generation cache stats into gauges for /metrics and the dump file"""
+    for generator, entry in hedging_report().items():
+        for stat, value in entry.items():
+            if stat.endswith("_seconds"):
+                if value is not None:
+                    generator_latency_gauge.set(value, generator=generator, quantile=str(int(stat[1:3]) / 100))
+            else:
+                hedge_gauge.set(value, generator=generator, stat=stat)
+    for stat, value in generation_cache.stats().items():
+        generation_cache_gauge.set(value, stat=stat)
+
+
+metrics.registry.add_collector(_collect_stats)
+
+
+def generate_image(prompt, generator, session_dir, deterministic=False, hedge=False):
+    """
+    Generate an image with the selected generator and save it to session_dir.
+    In deterministic mode the prompt is sent unchanged and results are served from
+    the generation cache when the same request was made before.
+    With hedge enabled, slow requests are raced against a fallback generator.
+    Returns the image path or an error string.
+    """
     try:
-        logging.info("Received request to generate image")
-        logging.info(f"Prompt: {prompt}, Generator: {generator}")
+        logger.info("Received request to generate image with generator: %s", generator)
+        logger.debug("Prompt: %s", prompt)
 
         if not prompt or not generator:
-            logging.error("Prompt and generator type are required.")
+            logger.error("Prompt and generator type are required.")
             return "Prompt and generator type are required."
 
-        unique_prompt = f"{prompt} - {random_sig()}"
-        logging.debug(f"Unique prompt: {unique_prompt}")
-
-        image_bytes = None
-        
-        if generator == "flux":
-            image_bytes = query_flux_image(unique_prompt)
-        elif generator == "stability":
-            image_bytes = query_stability_image(unique_prompt)
-        elif generator == "boreal":
-            image_bytes = query_boreal_image(unique_prompt)
-        elif generator == "phantasma-anime":
-            image_bytes = query_phantasma_anime_image(unique_prompt)
-        else:
-            logging.error("Invalid generator selected")
+        api_url = generator_urls.get(generator)
+        if not api_url:
+            logger.error("Invalid generator selected")
             return "error: Invalid generator selected"
 
+        # The extension is added once the output format is known
+        image_id = uuid.uuid4().hex[:8]
+        image_base = os.path.join(session_dir, f"{generator}_{image_id}")
+
+        if deterministic:
+            cache_key = GenerationCache.make_key("generate_image", generator, prompt=prompt)
+            cached_path = generation_cache.restore(cache_key, image_base)
+            metrics.cache_lookups_total.inc(operation="generate_image", result="hit" if cached_path else "miss")
+            if cached_path:
+                metrics.requests_total.inc(operation="generate_image", generator=generator, outcome="cached")
+                return store_asset(cached_path)
+            unique_prompt = prompt
+        else:
+            unique_prompt = f"{prompt} - {random_sig()}"
+        logger.debug("Unique prompt: %s", unique_prompt)
+
+        with metrics.timer("query", generator=generator):
+            if hedge:
+                image_bytes, used_generator = fetch_image_hedged(unique_prompt, generator)
+            else:
+                image_bytes, used_generator = fetch_image(unique_prompt, generator), generator
+
         if not image_bytes:
-            logging.error("Failed to generate image from the selected API.")
+            logger.error("Failed to generate image from the selected API.")
+            metrics.requests_total.inc(operation="generate_image", generator=generator, outcome="failed")
             return "error: Failed to generate image from the selected API."
 
-        image_name = f"{generator}_{uuid.uuid4().hex[:8]}.png"
-        image_path = os.path.join(session_dir, image_name)
-        logging.debug(f"Saving image to: {image_path}")
+        if used_generator != generator:
+            logger.info("Hedge request to %s won over %s", used_generator, generator)
+            image_base = os.path.join(session_dir, f"{used_generator}_{image_id}")
+
+        logger.debug("Saving image to: %s", image_base)
 
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            image.save(image_path)
-            logging.info(f"Image saved successfully: {image_name}")
-            return image_path  # Return the path of the saved image
+            image_path = save_image_bytes(image_bytes, image_base, output_codec, png_compress_level)
+            logger.info("Image saved successfully: %s", os.path.basename(image_path))
         except Exception as e:
-            logging.error(f"Error saving image: {e}")
+            logger.error("Error saving image: %s", e)
+            metrics.requests_total.inc(operation="generate_image", generator=generator, outcome="failed")
             return "error: Error saving image"
 
+        metrics.requests_total.inc(operation="generate_image", generator=used_generator, outcome="succeeded")
+        # Only cache output that actually came from the requested generator
+        if deterministic and used_generator == generator:
+            generation_cache.put(cache_key, image_path)
+        return store_asset(image_path)  # Return the path of the saved image
+
     except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return str(e)
 
 
+def generate_images(prompts, generators, session_dir, max_workers=None, deterministic=False, hedge=False):
+    """
+    Generate images for every combination of prompts and generators concurrently.
+    Requests share the pooled HTTP session and respect the per-generator concurrency cap.
+    Yields (prompt, generator, result) tuples in completion order, where result is the
+    image path or error string returned by generate_image.
+    """
+    if isinstance(prompts, str):
+        prompts = [prompts]
+    if isinstance(generators, str):
+        generators = [generators]
+
+    tasks = [(prompt, generator) for prompt in prompts for generator in generators]
+    if not tasks:
+        return
+
+    if max_workers is None:
+        max_workers = min(len(tasks), max_concurrency_per_generator * len(set(generators)))
+    logger.info("Generating %s images with %s workers", len(tasks), max_workers)
 
-def generate_video(image_path, session_dir):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(generate_image, prompt, generator, session_dir, deterministic, hedge): (prompt, generator)
+            for prompt, generator in tasks
+        }
+        for future in as_completed(futures):
+            prompt, generator = futures[future]
+            yield prompt, generator, future.result()
+
+
+
+def wait_for_prediction(prediction, cancel_event=None, poll_interval=1.0):
+    """
+    Poll a Replicate prediction until it reaches a final status.
+    If cancel_event is set while waiting, the prediction is cancelled and False is returned.
+    """
+    cancel_event = cancel_event or threading.Event()
+    while prediction.status not in ("succeeded", "failed", "canceled"):
+        # Waiting on the event doubles as the poll delay
+        if cancel_event.wait(poll_interval):
+            logger.info("Cancelling prediction %s", prediction.id)
+            prediction.cancel()
+            return False
+        prediction.reload()
+    return True
+
+
+
+def share_output(result, dest_path):
+    """
+    Make a coalesced prediction's output available at dest_path for a caller that joined it.
+    Callers in the same session directory get the leader's file; others get a hard link or copy.
+    """
+    if result.startswith("error") or os.path.dirname(result) == os.path.dirname(dest_path):
+        return result
     try:
-        logging.info("Starting video generation process")
+        os.link(result, dest_path)
+    except OSError:
+        shutil.copyfile(result, dest_path)
+    logger.info("Shared in-flight prediction output %s as %s", result, dest_path)
+    return dest_path
 
-        api_token = os.getenv("REPLICATE_API_TOKEN")
-        if not api_token:
-            logging.error("API Token not found. Please check your .env file.")
-            return "error: API Token not found"
 
-        # Get the model and version
-        logging.debug("Fetching model and version")
+def _run_video_prediction(image_path, input_hash, video_path, cancel_event):
+    """Run the video prediction and download its output. Returns (video path or error string, sha256)."""
+    # Get the model and version
+    logger.debug("Fetching model and version")
+    try:
+        with metrics.timer("model_lookup", operation="generate_video"):
+            version = model_registry.get_version(video_model_name, video_model_version)
+    except Exception as e:
+        logger.error("Error fetching model or version: %s", e)
+        return "error: Error fetching model or version", None
+
+    # Upload a copy sized for the model rather than the original file
+    upload_path = input_preparer.prepare(image_path, input_hash, "svd", target=video_input_size)
+
+    # Open the image file
+    with open(upload_path, 'rb') as image_file:
+        logger.info("Creating prediction for image file: %s", upload_path)
         try:
-            model = replicate.models.get("sunfjun/stable-video-diffusion")
-            version = model.versions.get("d68b6e09eedbac7a49e3d8644999d93579c386a083768235cabca88796d70d82")
+            # Create a prediction (includes uploading the input image)
+            with metrics.timer("create_prediction", operation="generate_video"):
+                prediction = model_registry.client.predictions.create(
+                    version=version,
+                    input={"input_image": image_file, **video_params}
+                )
         except Exception as e:
-            logging.error(f"Error fetching model or version: {e}")
-            return "error: Error fetching model or version"
+            logger.error("Error creating prediction: %s", e)
+            return "error: Error creating prediction", None
+
+    # Wait for the prediction to complete
+    logger.info("Waiting for prediction to complete")
+    with metrics.timer("prediction_wait", operation="generate_video"):
+        finished = wait_for_prediction(prediction, cancel_event)
+    if not finished:
+        return "error: Video generation cancelled", None
+
+    # Check the status and get the output
+    if prediction.status == 'succeeded':
+        output_url = prediction.output
+        logger.info("Prediction succeeded, video URL: %s", output_url)
+
+        # Stream the video straight to the session directory
+        with metrics.timer("payload_transfer", operation="generate_video"):
+            video_hash = stream_download(output_url, video_path, session=http_session, max_bytes=max_download_bytes)
+        logger.info("Video saved successfully at %s (sha256 %s)", video_path, video_hash)
+        return video_path, video_hash  # The hash saves the asset store from reading the video again
+    else:
+        logger.error("Prediction failed with status: %s, detail: %s", prediction.status, prediction.error)
+        return f"error: Prediction failed with status: {prediction.status}", None
+
+
+def generate_video(image_path, session_dir, cancel_event=None, deterministic=False):
+    # The Replicate SDK is slow to import, so it stays off the app's startup path
+    import replicate
+
+    try:
+        logger.info("Starting video generation process")
+
+        api_token = os.getenv("REPLICATE_API_TOKEN")
+        if not api_token:
+            logger.error("API Token not found. Please check your .env file.")
+            return "error: API Token not found"
 
         if not image_path:
-            logging.error("No image path provided")
+            logger.error("No image path provided")
             return "error: Image path is required"
 
-        # Construct the full path to the image
-        full_image_path = image_path
-        logging.debug(f"Full image path: {full_image_path}")
-
-        # Open the image file
-        with open(full_image_path, 'rb') as image_file:
-            logging.info(f"Creating prediction for image file: {full_image_path}")
-            try:
-                # Create a prediction
-                prediction = replicate.predictions.create(
-                    version=version,
-                    input={
-                        "input_image": image_file,
-                        "cond_aug": 0.05,
-                        "decoding_t": 14,
-                        "video_length": "14_frames_with_svd",
-                        "sizing_strategy": "maintain_aspect_ratio",
-                        "motion_bucket_id": 127,
-                        "frames_per_second": 6
-                    }
-                )
-            except Exception as e:
-                logging.error(f"Error creating prediction: {e}")
-                return "error: Error creating prediction"
-
-            # Wait for the prediction to complete
-            logging.info("Waiting for prediction to complete")
-            prediction.wait()
+        video_name = f"video_{uuid.uuid4().hex[:8]}.mp4"
+        video_path = os.path.join(session_dir, video_name)
 
-            # Check the status and get the output
-            if prediction.status == 'succeeded':
-                output_url = prediction.output
-                logging.info(f"Prediction succeeded, video URL: {output_url}")
+        # The same key identifies cached results and identical in-flight predictions
+        input_hash = file_sha256(image_path)
+        request_key = GenerationCache.make_key(
+            "generate_video", f"{video_model_name}:{video_model_version}",
+            params=video_params, input_hash=input_hash
+        )
 
-                # Download the video
-                video_response = requests.get(output_url)
-                video_response.raise_for_status()
+        if deterministic:
+            cached = generation_cache.restore(request_key, video_path)
+            metrics.cache_lookups_total.inc(operation="generate_video", result="hit" if cached else "miss")
+            if cached:
+                return store_asset(video_path)
 
-                # Save the video to the static directory
-                video_name = f"video_{uuid.uuid4().hex[:8]}.mp4"
-                video_path = os.path.join(session_dir, video_name)
-                with open(video_path, 'wb') as video_file:
-                    video_file.write(video_response.content)
+        # The prediction is only cancelled once every caller sharing it has cancelled
+        try:
+            (result, output_hash), shared = inflight_predictions.do(
+                request_key,
+                lambda shared_cancel: _run_video_prediction(image_path, input_hash, video_path, shared_cancel),
+                cancel_event=cancel_event
+            )
+        except CancelledError:
+            return "error: Video generation cancelled"
+        if shared:
+            return store_asset(share_output(result, video_path), output_hash)
 
-                logging.info(f"Video saved successfully at {video_path}")
+        if deterministic and not result.startswith("error"):
+            generation_cache.put(request_key, video_path)
+        return store_asset(result, output_hash)
 
-                return video_path  # Return the path of the saved video
-            else:
-                logging.error(f"Prediction failed with status: {prediction.status}, detail: {prediction.error}")
-                return f"error: Prediction failed with status: {prediction.status}"
+    except FileNotFoundError:
+        logger.error("Image file not found at path: %s", image_path)
+        return "error: Image file not found"
 
     except replicate.exceptions.ReplicateError as e:
-        logging.error(f"Replicate API error during video generation: {e}")
+        logger.error("Replicate API error during video generation: %s", e)
         return "error: An error occurred with the Replicate API"
 
+    except DownloadError as e:
+        logger.error("Error downloading video: %s", e)
+        return "error: An error occurred while downloading the video"
+
     except Exception as e:
-        logging.error(f"Unexpected error during video generation: {e}")
+        logger.error("Unexpected error during video generation: %s", e)
         return f"error: An unexpected error occurred: {e}"
 
 
 
 
-def upscale_image(image_path, session_dir):
-    logging.debug("Received request to upscale image")
+def _run_upscale_prediction(image_path, input_hash, upscaled_image_path, cancel_event):
+    """Run the upscale prediction and download its output. Returns (image path or error string, sha256)."""
+    # In "original" resolution mode the refiner works at the input size, so only the encoding can shrink
+    upload_path = input_preparer.prepare(image_path, input_hash, "refiner_original")
+
+    # Open the image file
+    with open(upload_path, 'rb') as image_file:
+        logger.info("Creating prediction for image upscaling")
+        # Create the prediction directly so it can be polled and cancelled
+        with metrics.timer("create_prediction", operation="upscale_image"):
+            prediction = model_registry.client.predictions.create(
+                version=upscale_model_version,
+                input={"image": image_file, **upscale_params}
+            )
+
+    with metrics.timer("prediction_wait", operation="upscale_image"):
+        finished = wait_for_prediction(prediction, cancel_event)
+    if not finished:
+        return "error: Upscaling cancelled", None
+
+    # Check if the prediction is successful
+    output = prediction.output
+    if prediction.status == 'succeeded' and isinstance(output, list) and len(output) > 0:
+        output_url = output[0]
+        logger.info("Prediction succeeded, output URL: %s", output_url)
+
+        # Stream the upscaled image straight to the session directory
+        with metrics.timer("payload_transfer", operation="upscale_image"):
+            upscaled_hash = stream_download(
+                output_url, upscaled_image_path, session=http_session, max_bytes=max_download_bytes
+            )
+        logger.info("Upscaled image saved successfully at %s (sha256 %s)", upscaled_image_path, upscaled_hash)
+
+        # Return the path of the saved upscaled image and its hash
+        return upscaled_image_path, upscaled_hash
+    else:
+        logger.error("Prediction failed or returned no output")
+        return "error: Prediction failed or returned no output", None
+
+
+def upscale_image(image_path, session_dir, cancel_event=None, deterministic=False):
+    import replicate
+
+    logger.debug("Received request to upscale image")
 
     if not image_path:
-        logging.error("Image path not provided in the request")
+        logger.error("Image path not provided in the request")
         return "error: Image path is required"
 
     try:
         # Use the full path directly from the input
         full_image_path = image_path
-        logging.debug(f"Full image path: {full_image_path}")
-
-        # Open the image file
-        with open(full_image_path, 'rb') as image_file:
-            logging.info("Creating prediction for image upscaling")
-            # Correctly use the replicate API
-            prediction = replicate.run(
-                "batouresearch/magic-image-refiner:507ddf6f977a7e30e46c0daefd30de7d563c72322f9e4cf7cbac52ef0f667b13",
-                input={
-                    "hdr": 0,
-                    "image": image_file,
-                    "steps": 20,
-                    "prompt": "UHD 4k",
-                    "scheduler": "DDIM",
-                    "creativity": 0.25,
-                    "guess_mode": False,
-                    "resolution": "original",
-                    "resemblance": 0.75,
-                    "guidance_scale": 7,
-                    "negative_prompt": "teeth, tooth, open mouth, longbody, lowres, bad anatomy, bad hands, missing fingers, extra digit, fewer digits, cropped, worst quality, low quality, mutant"
-                }
-            )
+        logger.debug("Full image path: %s", full_image_path)
 
-            # Check if the prediction is successful
-            if isinstance(prediction, list) and len(prediction) > 0:
-                output_url = prediction[0]
-                logging.info(f"Prediction succeeded, output URL: {output_url}")
+        upscaled_image_name = f"upscaled_{uuid.uuid4().hex[:8]}.png"
+        upscaled_image_path = os.path.join(session_dir, upscaled_image_name)
 
-                # Download the upscaled image
-                upscaled_image_response = requests.get(output_url)
-                upscaled_image_response.raise_for_status()
+        # The same key identifies cached results and identical in-flight predictions
+        input_hash = file_sha256(full_image_path)
+        request_key = GenerationCache.make_key(
+            "upscale_image", upscale_model_version,
+            params=upscale_params, input_hash=input_hash
+        )
 
-                # Save the upscaled image to the static directory
-                upscaled_image_name = f"upscaled_{uuid.uuid4().hex[:8]}.png"
-                upscaled_image_path = os.path.join(session_dir, upscaled_image_name)
-                with open(upscaled_image_path, 'wb') as upscaled_image_file:
-                    upscaled_image_file.write(upscaled_image_response.content)
+        if deterministic:
+            cached = generation_cache.restore(request_key, upscaled_image_path)
+            metrics.cache_lookups_total.inc(operation="upscale_image", result="hit" if cached else "miss")
+            if cached:
+                return store_asset(upscaled_image_path)
 
-                logging.info(f"Upscaled image saved successfully at {upscaled_image_path}")
+        try:
+            (result, output_hash), shared = inflight_predictions.do(
+                request_key,
+                lambda shared_cancel: _run_upscale_prediction(
+                    full_image_path, input_hash, upscaled_image_path, shared_cancel
+                ),
+                cancel_event=cancel_event
+            )
+        except CancelledError:
+            return "error: Upscaling cancelled"
+        if shared:
+            return store_asset(share_output(result, upscaled_image_path), output_hash)
 
-                # Return the path of the saved upscaled image
-                return upscaled_image_path
-            else:
-                logging.error("Prediction failed or returned no output")
-                return "error: Prediction failed or returned no output"
+        if deterministic and not result.startswith("error"):
+            generation_cache.put(request_key, upscaled_image_path)
+        return store_asset(result, output_hash)
 
     except FileNotFoundError:
-        logging.error(f"Image file not found at path: {full_image_path}")
+        logger.error("Image file not found at path: %s", full_image_path)
         return "error: Image file not found"
 
     except replicate.exceptions.ReplicateError as e:
-        logging.error(f"Replicate API error during prediction: {e}")
+        logger.error("Replicate API error during prediction: %s", e)
         return "error: An error occurred with the Replicate API"
 
+    except DownloadError as e:
+        logger.error("Error downloading upscaled image: %s", e)
+        return "error: An error occurred while downloading the upscaled image"
+
     except requests.exceptions.RequestException as e:
-        logging.error(f"HTTP request error: {e}")
+        logger.error("HTTP request error: %s", e)
         return "error: An error occurred while making an HTTP request"
 
     except Exception as e:
-        logging.error(f"Unexpected error during prediction: {e}")
+        logger.error("Unexpected error during prediction: %s", e)
         return f"error: An unexpected error occurred: {e}"
 
 
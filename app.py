@@ -1,25 +1,67 @@
+import time
+
+# Started before the other imports so the first run of a process also counts their cost
+rerun_start = time.perf_counter()
+
 import streamlit as st
-from api import generate_image, generate_video, upscale_image
+from api import (
+    generate_images, generate_video, upscale_image, generator_urls, start_model_warmer, asset_store,
+    prewarm_replicate_models, inflight_predictions
+)
 import os
+import re
 import uuid
+import mimetypes
+import math
 import logging
-from PIL import Image
+import metrics
 from session_manager import SessionManager
+from jobs import JobManager, SUCCEEDED, FAILED
+from thumbnails import get_thumbnail, is_video, verify_image
+from image_codec import format_extensions, sniff_format
+from history_store import HistoryStore
+from compaction import AssetCompactor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging; LOG_LEVEL=DEBUG also logs prompts and per-rerun details
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
 logger = logging.getLogger(__name__)
 
+metrics.stage_seconds.observe(time.perf_counter() - rerun_start, stage="app_imports")
+
+# Number of history entries rendered per page
+HISTORY_PAGE_SIZE = 10
+
+# Reruns slower than this are counted in source_studio_rerun_budget_exceeded_total
+RERUN_BUDGET_SECONDS = float(os.getenv("RERUN_BUDGET_MS", "250")) / 1000
+
+# Session IDs accepted from the URL; anything else could escape the user files directory
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{8}")
+
+
+def observe_run(start, stage):
+    """Record the duration of a script or fragment run and count it if it went over the rerun budget"""
+    seconds = time.perf_counter() - start
+    metrics.stage_seconds.observe(seconds, stage=stage)
+    if seconds > RERUN_BUDGET_SECONDS:
+        metrics.rerun_budget_exceeded_total.inc(stage=stage)
+        logger.warning(
+            "%s took %.0f ms, over the %.0f ms budget", stage, seconds * 1000, RERUN_BUDGET_SECONDS * 1000
+        )
+
+
+def rerun_app():
+    """st.rerun() ends this run by raising, so its timing is recorded first"""
+    observe_run(rerun_start, "app_rerun")
+    st.rerun()
+
 
 # Set up the Streamlit app
 st.title("Source Studio")
 st.write("Generate images using different AI models by providing a prompt and selecting a generator.")
-logger.info("Source Studio app started.")
-
-# Initialize session state for conversation history
-if 'history' not in st.session_state:
-    st.session_state.history = []
-    logger.info("Initialized conversation history.")
+logger.debug("Source Studio app started.")
 
 # Initialize session state for the current image being edited
 if 'current_edit' not in st.session_state:
@@ -31,124 +73,279 @@ if 'uploaded_file_processed' not in st.session_state:
     st.session_state.uploaded_file_processed = False
     logger.info("Initialized uploaded file processed session state.")
 
-# Initialize session manager
-session_manager = SessionManager()
+# Background jobs live for the whole process so they survive script reruns
+@st.cache_resource
+def get_job_manager():
+    return JobManager(max_workers=4)
+
+job_manager = get_job_manager()
+
+# Initialize session state for background jobs (job ID -> history label)
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = {}
+    logger.info("Initialized background jobs session state.")
+
+# One session manager per process; its janitor thread removes expired sessions off the request path
+@st.cache_resource
+def get_session_manager():
+    manager = SessionManager(quota_mb=int(os.getenv("SESSION_QUOTA_MB", "500")), asset_store=asset_store)
+    manager.start_janitor()
+    return manager
 
-# Initialize session state
+session_manager = get_session_manager()
+
+# Rewrite images nobody has looked at for COMPACTION_COLD_MINUTES as lossless WebP, yielding to live work
+@st.cache_resource
+def get_asset_compactor():
+    compactor = AssetCompactor(
+        session_manager.user_files_dir,
+        asset_store=asset_store,
+        cold_seconds=float(os.getenv("COMPACTION_COLD_MINUTES", "60")) * 60,
+        interval=float(os.getenv("COMPACTION_INTERVAL", "600")),
+        is_busy=lambda: job_manager.has_active_jobs() or inflight_predictions.in_flight() > 0
+    )
+    compactor.start()
+    return compactor
+
+get_asset_compactor()
+
+# Expose pipeline metrics through METRICS_PORT and/or METRICS_DUMP_PATH
+@st.cache_resource
+def start_metrics_exporters():
+    metrics.start_exporters()
+
+start_metrics_exporters()
+
+# Keep the models listed in HF_WARM_MODELS loaded between generations
+@st.cache_resource
+def get_model_warmer():
+    return start_model_warmer()
+
+get_model_warmer()
+
+# Look up the Replicate model versions once per process, ahead of the first video request
+@st.cache_resource
+def get_replicate_prewarm():
+    return prewarm_replicate_models()
+
+get_replicate_prewarm()
+
+# Initialize session state; the session ID is kept in the URL so a refresh reconnects to the same session
 if 'session_id' not in st.session_state:
-    st.session_state.session_id = uuid.uuid4().hex[:8]
-    
-# Get session directory
-session_dir = session_manager.get_session_dir(st.session_state.session_id)
+    requested_session_id = st.query_params.get("session", "")
+    if SESSION_ID_PATTERN.fullmatch(requested_session_id):
+        st.session_state.session_id = requested_session_id
+        logger.info("Reconnected to session %s", requested_session_id)
+    else:
+        st.session_state.session_id = uuid.uuid4().hex[:8]
+    st.query_params["session"] = st.session_state.session_id
 
-# Clean up expired sessions on app start
-session_manager.cleanup_expired_sessions()
+# Get session directory; reruns only record the access unless the janitor removed the directory
+session_dir = st.session_state.get("session_dir")
+if session_dir and os.path.isdir(session_dir):
+    session_manager.touch(st.session_state.session_id)
+else:
+    if session_dir:
+        logger.info("Session directory %s was removed, recreating it", session_dir)
+        # The history database went with the directory
+        st.session_state.pop("history", None)
+    session_dir = st.session_state.session_dir = session_manager.get_session_dir(st.session_state.session_id)
+
+# Initialize the conversation history, restoring it from the session directory after a reconnect
+if 'history' not in st.session_state:
+    st.session_state.history = HistoryStore(session_dir)
+    logger.info("Loaded conversation history with %s entries.", len(st.session_state.history))
 
 # Input for the prompt
 prompt = st.chat_input("Say something")
-logger.info(f"Received prompt: {prompt}")
+logger.debug("Received prompt: %s", prompt)
 
 # Dropdown for selecting the generator
 generator = st.selectbox(
     "Select a generator",
-    ("flux", "stability", "boreal", "phantasma-anime")
+    tuple(generator_urls)
+)
+logger.debug("Generator selected: %s", generator)
+
+# Optional extra generators to run side by side with the selected one
+compare_generators = st.multiselect(
+    "Compare with",
+    [name for name in generator_urls if name != generator]
+)
+
+# Deterministic mode reuses cached results for identical requests
+deterministic = st.toggle(
+    "Deterministic mode",
+    help="Send prompts unchanged and reuse cached results for identical requests instead of paying for new generations."
+)
+
+# Hedging races slow requests against a fallback generator
+hedge = st.toggle(
+    "Hedge slow requests",
+    help="If a generator is slower than usual, send the same prompt to a fallback and keep the first result."
 )
-logger.info(f"Generator selected: {generator}")
 
 # Automatically generate the image when a prompt is entered
 if prompt:
     st.write(f"Prompt: {prompt}")
-    result = generate_image(prompt, generator, session_dir)
-    logger.info(f"Generated image with prompt '{prompt}' using generator '{generator}'")
+    # Run all selected generators concurrently and collect results as they finish
+    for _, used_generator, result in generate_images(prompt, [generator] + compare_generators, session_dir, deterministic=deterministic, hedge=hedge):
+        logger.info("Generated image using generator '%s'", used_generator)
 
-    if result.startswith("error"):
-        st.error(result)
-        logger.error(f"Error generating image: {result}")
-    else:
-        st.session_state.history.append((prompt, result))
-        logger.info(f"Image generation successful, added to history.")
+        if result.startswith("error"):
+            st.error(f"{used_generator}: {result}")
+            logger.error("Error generating image: %s", result)
+        else:
+            st.session_state.history.add(prompt, result)
+            logger.info("Image generation successful, added to history.")
 
 # Upload an image
 uploaded_file = st.file_uploader("Upload an image", type=["png", "jpg", "jpeg", "webp"])
 
 if uploaded_file is not None and not st.session_state.uploaded_file_processed:
-    uploaded_image_name = f"uploaded_image_{uuid.uuid4().hex[:8]}.png"
-    uploaded_image_path = os.path.join('static', uploaded_image_name)
-    
-    with open(uploaded_image_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    logger.info(f"Uploaded image saved at path: {uploaded_image_path}")
+    # Keep the real format's extension; the upload is streamed into the asset store in chunks
+    uploaded_format = sniff_format(uploaded_file.read(12))
+    uploaded_file.seek(0)
+    uploaded_image_path = asset_store.store_stream(
+        uploaded_file, format_extensions.get(uploaded_format, ".png"), session_dir, "uploaded_image"
+    )
+    logger.info("Uploaded image saved at path: %s", uploaded_image_path)
     
-    st.session_state.history.append(("Uploaded Image", uploaded_image_path))
+    st.session_state.history.add("Uploaded Image", uploaded_image_path)
     st.session_state.uploaded_file_processed = True
     st.success("Image uploaded successfully!")
 
-# Display the conversation history
+# Hand off results of finished background jobs into the history
+for job_id, label in list(st.session_state.jobs.items()):
+    job = job_manager.get(job_id)
+    if job is not None and not job.done:
+        continue
+
+    del st.session_state.jobs[job_id]
+    if job is None:
+        continue
+    job_manager.pop(job_id)
+
+    if job.status == SUCCEEDED:
+        if st.session_state.history.add(label, job.result):
+            logger.info("Background job result added to history: %s", job.result)
+    elif job.status == FAILED:
+        st.error(f"{label} failed: {job.error}")
+        logger.error("Background job %s failed: %s", job_id, job.error)
+    else:
+        st.info(f"{label} was cancelled")
+
+
+# Poll running jobs without blocking the rest of the page
+@st.fragment(run_every=2)
+def show_running_jobs():
+    fragment_start = time.perf_counter()
+    try:
+        st.write("### Running Jobs")
+        any_finished = False
+        for job_id, label in list(st.session_state.jobs.items()):
+            job = job_manager.get(job_id)
+            if job is None or job.done:
+                any_finished = True
+                continue
+            st.write(f"{label}: {job.status}")
+            st.button("Cancel", key=f"cancel_{job_id}", on_click=job_manager.cancel, args=(job_id,))
+    finally:
+        observe_run(fragment_start, "app_fragment")
+
+    # Rerun the full app so finished results move into the history
+    if any_finished:
+        st.rerun()
+
+if st.session_state.jobs:
+    show_running_jobs()
+
+# Display the conversation history one page at a time
 st.write("### Conversation History")
-for i, (past_prompt, image_path) in enumerate(st.session_state.history):
+history = st.session_state.history
+page_count = max(1, math.ceil(len(history) / HISTORY_PAGE_SIZE))
+
+# Jump to the newest page whenever the history grows onto a new page
+if st.session_state.get("history_page_count") != page_count:
+    st.session_state.history_page_count = page_count
+    st.session_state.history_page = page_count
+
+if page_count > 1:
+    page = st.number_input("History page", min_value=1, max_value=page_count, key="history_page")
+else:
+    page = 1
+
+thumbnail_dir = os.path.join(session_dir, ".thumbnails")
+history_render_start = time.perf_counter()
+page_start = (page - 1) * HISTORY_PAGE_SIZE
+page_entries = history.page(page_start, HISTORY_PAGE_SIZE)
+# Shown entries stay warm, so the compactor leaves them alone
+history.mark_viewed([image_path for _, image_path in page_entries])
+for i, (past_prompt, image_path) in enumerate(page_entries, start=page_start):
     st.write(f"Prompt {i+1}: {past_prompt}")
-    logger.info(f"Displaying history entry {i+1} - Prompt: {past_prompt}")
+    logger.debug("Displaying history entry %s - Prompt: %s", i+1, past_prompt)
 
-    try:
-        with open(image_path, "rb") as img_file:
-            img = Image.open(img_file)
-            img.verify()
+    # Only thumbnails are sent by default; full resolution and videos load on demand
+    if is_video(image_path):
+        if not os.path.exists(image_path):
+            st.error(f"Error displaying video {i+1}: file not found")
+        elif st.toggle("Play video", key=f"full_{i}"):
+            st.video(image_path)
+    else:
+        error = verify_image(image_path)
+        if error:
+            st.error(f"Error displaying image {i+1}: {error}")
+            logger.error("Error encountered for image %s: %s", i+1, error)
+        elif st.toggle("Full resolution", key=f"full_{i}"):
             st.image(image_path, caption=f"Generated Image {i+1}")
-            logger.info(f"Image {i+1} displayed successfully.")
-    except (FileNotFoundError, Image.UnidentifiedImageError) as e:
-        st.error(f"Error displaying image {i+1}: {e}")
-        logger.error(f"Error encountered for image {i+1}: {e}")
+        else:
+            st.image(get_thumbnail(image_path, thumbnail_dir), caption=f"Generated Image {i+1}")
+            logger.debug("Image %s displayed successfully.", i+1)
 
     image_name = os.path.basename(image_path)
 
     if st.button(f"Edit {image_name}", key=f"edit_{i}"):
         st.session_state.current_edit = image_name
-        logger.info(f"Set current edit to image: {image_name}")
+        logger.info("Set current edit to image: %s", image_name)
+
+metrics.stage_seconds.observe(time.perf_counter() - history_render_start, stage="history_render")
 
 # Sidebar content
 if st.session_state.current_edit:
+    current_prompt, current_image_path = st.session_state.history.get(st.session_state.current_edit)
+    # The asset may have been renamed by compaction since it was selected
+    if current_image_path:
+        st.session_state.current_edit = os.path.basename(current_image_path)
+        st.session_state.history.mark_viewed([current_image_path])
     st.sidebar.title(f"Edit {st.session_state.current_edit}")
-
-    current_prompt, current_image_path = next(
-        ((p, img) for p, img in st.session_state.history if os.path.basename(img) == st.session_state.current_edit), 
-        (None, None)
-    )
-    logger.info(f"Editing image: {current_image_path} with prompt: '{current_prompt}'")
+    logger.debug("Editing image: %s with prompt: '%s'", current_image_path, current_prompt)
 
     if st.sidebar.button("Upscale"):
-        upscaled_result = upscale_image(current_image_path, session_dir)
-        if upscaled_result.startswith("error"):
-            st.sidebar.error(upscaled_result)
-            logger.error(f"Error upscaling image: {upscaled_result}")
-        else:
-            st.image(upscaled_result, caption="Upscaled Image")
-            if (f"Upscaled {st.session_state.current_edit}", upscaled_result) not in st.session_state.history:
-                st.session_state.history.append((f"Upscaled {st.session_state.current_edit}", upscaled_result))
-                logger.info(f"Upscaled image added to history: {upscaled_result}")
+        label = f"Upscaled {st.session_state.current_edit}"
+        job_id = job_manager.submit(upscale_image, current_image_path, session_dir, deterministic=deterministic, label=label)
+        st.session_state.jobs[job_id] = label
+        logger.info("Submitted upscale job %s for image: %s", job_id, current_image_path)
+        rerun_app()
 
     if st.sidebar.button("Regenerate"):
         if current_prompt:
-            new_image_path = generate_image(current_prompt, generator, session_dir)
-            if new_image_path.startswith("error"):
-                st.sidebar.error(new_image_path)
-                logger.error(f"Error regenerating image: {new_image_path}")
-            else:
-                st.image(new_image_path, caption="Regenerated Image")
-                if (current_prompt, new_image_path) not in st.session_state.history:
-                    st.session_state.history.append((current_prompt, new_image_path))
-                    logger.info(f"Regenerated image added to history: {new_image_path}")
-                st.session_state.current_edit = os.path.basename(new_image_path)
+            # Through the fan-out pool, so saving and re-encoding stay off the script thread
+            for _, _, new_image_path in generate_images(current_prompt, generator, session_dir, deterministic=deterministic, hedge=hedge):
+                if new_image_path.startswith("error"):
+                    st.sidebar.error(new_image_path)
+                    logger.error("Error regenerating image: %s", new_image_path)
+                else:
+                    st.image(new_image_path, caption="Regenerated Image")
+                    if st.session_state.history.add(current_prompt, new_image_path):
+                        logger.info("Regenerated image added to history: %s", new_image_path)
+                    st.session_state.current_edit = os.path.basename(new_image_path)
 
     if st.sidebar.button("Image to Video"):
-        video_result = generate_video(current_image_path, session_dir)
-        if video_result.startswith("error"):
-            st.sidebar.error(video_result)
-            logger.error(f"Error generating video: {video_result}")
-        else:
-            st.video(video_result)
-            if (f"Video from {st.session_state.current_edit}", video_result) not in st.session_state.history:
-                st.session_state.history.append((f"Video from {st.session_state.current_edit}", video_result))
-                logger.info(f"Video added to history: {video_result}")
+        label = f"Video from {st.session_state.current_edit}"
+        job_id = job_manager.submit(generate_video, current_image_path, session_dir, deterministic=deterministic, label=label)
+        st.session_state.jobs[job_id] = label
+        logger.info("Submitted video job %s for image: %s", job_id, current_image_path)
+        rerun_app()
 
     if current_image_path:
         with open(current_image_path, "rb") as file:
@@ -156,9 +353,9 @@ if st.session_state.current_edit:
                 label="Download Image",
                 data=file,
                 file_name=st.session_state.current_edit,
-                mime="image/png"
+                mime=mimetypes.guess_type(current_image_path)[0] or "application/octet-stream"
             )
-            logger.info(f"Download button created for image: {current_image_path}")
+            logger.debug("Download button created for image: %s", current_image_path)
 
 else:
     st.sidebar.title("Edit Images")
@@ -168,4 +365,6 @@ else:
     st.sidebar.write("- Regenerating")
     st.sidebar.write("- Image to video generation")
     st.sidebar.write("- Downloading images/videos")
-    logger.info("No image selected for editing.")
+    logger.debug("No image selected for editing.")
+
+observe_run(rerun_start, "app_rerun")
@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from generation_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+
+class AssetStore:
+    """
+    Content-addressed store for uploaded and generated files.
+    Each distinct file is kept once as a blob named by its SHA-256, and session directories
+    hold hard links to the blobs. The link count of a blob is its reference count: a blob
+    whose only remaining link is the store's own is unreferenced and removed by collect_garbage.
+    """
+
+    def __init__(self, root, chunk_size=256 * 1024, gc_grace_seconds=300):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.gc_grace_seconds = gc_grace_seconds
+        self._lock = threading.Lock()  # Keeps garbage collection from racing new links
+        os.makedirs(root, exist_ok=True)
+
+    def blob_path(self, sha256, ext):
+        """Path of the blob for a content hash, whether or not it exists"""
+        return os.path.join(self.root, sha256[:2], f"{sha256}{ext.lower()}")
+
+    def _link(self, blob_path, dest_path):
+        """Hard-link a blob to dest_path, copying when the filesystem cannot link"""
+        try:
+            os.link(blob_path, dest_path)
+        except FileExistsError:
+            if os.path.samefile(blob_path, dest_path):
+                return
+            os.remove(dest_path)
+            os.link(blob_path, dest_path)
+        except OSError:
+            shutil.copyfile(blob_path, dest_path)
+
+    def put_stream(self, stream, ext):
+        """
+        Store the contents of a binary file object, hashing it while it is written.
+        Returns (sha256, blob_path); content the store already has is not kept twice.
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+            os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+
+            sha256 = digest.hexdigest()
+            blob_path = self.blob_path(sha256, ext)
+            with self._lock:
+                if os.path.exists(blob_path):
+                    os.remove(tmp_path)
+                    logger.debug("Asset %s already stored", sha256)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(tmp_path, blob_path)
+                    logger.info("Stored new asset %s", blob_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha256, blob_path
+
+    def store_stream(self, stream, ext, dest_dir, prefix):
+        """
+        Store a file object and link it into dest_dir as <prefix>_<hash><ext>.
+        The same content stored twice in one directory returns the existing file.
+        """
+        sha256, blob_path = self.put_stream(stream, ext)
+        dest_path = os.path.join(dest_dir, f"{prefix}_{sha256[:16]}{ext.lower()}")
+        with self._lock:
+            if not os.path.exists(dest_path):
+                self._link(blob_path, dest_path)
+        return dest_path
+
+    def adopt(self, path, sha256=None):
+        """
+        Move an existing file under store management: the first copy of some content becomes
+        the blob, and later files with the same content are replaced by links to it.
+        Pass sha256 if it is already known to skip hashing the file.
+        """
+        sha256 = sha256 or file_sha256(path)
+        blob_path = self.blob_path(sha256, os.path.splitext(path)[1])
+        with self._lock:
+            if os.path.exists(blob_path):
+                if os.path.samefile(blob_path, path):
+                    return blob_path
+                # Swap the duplicate for a link atomically so readers never see it missing
+                tmp_path = os.path.join(os.path.dirname(path), f".tmp_{sha256[:16]}")
+                self._link(blob_path, tmp_path)
+                os.replace(tmp_path, path)
+                logger.info("Deduplicated %s against %s", path, blob_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                self._link(path, blob_path)
+        return blob_path
+
+    def collect_garbage(self):
+        """Remove blobs no session links to any more. Returns (blobs removed, bytes freed)."""
+        removed = 0
+        freed = 0
+        cutoff = time.time() - self.gc_grace_seconds
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                with self._lock:
+                    try:
+                        stat = entry.stat()
+                        # ctime changes whenever a link is added or removed
+                        if stat.st_nlink > 1 or stat.st_ctime > cutoff:
+                            continue
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                removed += 1
+                freed += stat.st_size
+        if removed:
+            logger.info("Removed %s unreferenced assets (%s bytes)", removed, freed)
+        return removed, freed
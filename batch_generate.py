@@ -0,0 +1,233 @@
+"""
+Headless batch generation from a JSONL or CSV file of prompts.
+
+Each input row needs a "prompt" and may set "id", "generator", "upscale" and "video".
+Every finished item is appended to a JSONL manifest with its outputs and stage timings;
+running the same command again skips items the manifest already records as done and
+only redoes the missing stages of failed ones.
+
+    python batch_generate.py prompts.jsonl --output-dir static/batch/run1 --upscale --concurrency 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+true_values = ("1", "true", "yes", "y")
+
+
+def _flag(value):
+    """Read a boolean column that may come from JSON or CSV"""
+    if isinstance(value, str):
+        return value.strip().lower() in true_values
+    return bool(value)
+
+
+def load_items(path, default_generator, upscale=False, video=False):
+    """Read prompts from a .jsonl or .csv file into item dicts with a stable ID"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    items = []
+    for index, row in enumerate(rows):
+        prompt = (row.get("prompt") or "").strip()
+        if not prompt:
+            logger.warning("Skipping row %s without a prompt", index + 1)
+            continue
+        generator = row.get("generator") or default_generator
+        # Row position plus content, so IDs stay the same when the same file is read again
+        digest = hashlib.sha256(f"{generator}\n{prompt}".encode("utf-8")).hexdigest()[:8]
+        items.append({
+            "id": str(row.get("id") or f"{index + 1:05d}-{digest}"),
+            "prompt": prompt,
+            "generator": generator,
+            "upscale": _flag(row["upscale"]) if row.get("upscale") not in (None, "") else upscale,
+            "video": _flag(row["video"]) if row.get("video") not in (None, "") else video,
+        })
+    return items
+
+
+class Manifest:
+    """Append-only JSONL record of finished items; the last record for an ID wins"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    self.records[record["id"]] = record
+
+    def append(self, record):
+        """Write a record and flush it to disk before returning"""
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.records[record["id"]] = record
+
+
+def run_item(api, item, output_dir, previous=None, deterministic=False, hedge=False):
+    """
+    Run the stages of one item, reusing outputs of an earlier attempt that still exist.
+    Returns the manifest record.
+    """
+    outputs = {}
+    timings = {}
+    if previous:
+        outputs = {stage: path for stage, path in previous.get("outputs", {}).items() if os.path.exists(path)}
+
+    stages = [("image", lambda: api.generate_image(
+        item["prompt"], item["generator"], output_dir, deterministic=deterministic, hedge=hedge
+    ))]
+    if item["upscale"]:
+        stages.append(("upscaled", lambda: api.upscale_image(outputs["image"], output_dir, deterministic=deterministic)))
+    if item["video"]:
+        stages.append(("video", lambda: api.generate_video(outputs["image"], output_dir, deterministic=deterministic)))
+
+    error = None
+    for stage, run in stages:
+        if stage in outputs:
+            continue
+        start = time.perf_counter()
+        result = run()
+        timings[stage] = round(time.perf_counter() - start, 3)
+        if result.startswith("error") or not os.path.exists(result):
+            error = f"{stage}: {result}"
+            # Later stages all start from the image
+            if stage == "image":
+                break
+            continue
+        outputs[stage] = result
+
+    return {
+        "id": item["id"],
+        "prompt": item["prompt"],
+        "generator": item["generator"],
+        "status": "failed" if error else "succeeded",
+        "outputs": outputs,
+        "timings": timings,
+        "error": error,
+        "finished_at": time.time(),
+    }
+
+
+def _failed_record(item, error):
+    """Manifest record for an item whose run raised instead of returning a record"""
+    return {
+        "id": item["id"],
+        "prompt": item["prompt"],
+        "generator": item["generator"],
+        "status": "failed",
+        "outputs": {},
+        "timings": {},
+        "error": error,
+        "finished_at": time.time(),
+    }
+
+
+def _run_and_record(api, item, output_dir, manifest, deterministic, hedge):
+    # Recorded from the worker so items still running after Ctrl-C are not lost
+    record = run_item(api, item, output_dir, manifest.records.get(item["id"]), deterministic, hedge)
+    manifest.append(record)
+    return record
+
+
+def run_batch(api, items, output_dir, manifest, concurrency=4, deterministic=False, hedge=False):
+    """Run all items not yet finished in the manifest. Returns (succeeded, failed, skipped)."""
+    pending = [item for item in items if manifest.records.get(item["id"], {}).get("status") != "succeeded"]
+    skipped = len(items) - len(pending)
+    if skipped:
+        logger.info("Resuming: %s of %s items already done", skipped, len(items))
+
+    succeeded = failed = 0
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    try:
+        futures = {
+            executor.submit(_run_and_record, api, item, output_dir, manifest, deterministic, hedge): item
+            for item in pending
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                record = _failed_record(item, f"{type(e).__name__}: {e}")
+                try:
+                    manifest.append(record)
+                except OSError as append_error:
+                    logger.error("Error recording item %s in the manifest: %s", item["id"], append_error)
+            if record["status"] == "succeeded":
+                succeeded += 1
+            else:
+                failed += 1
+                logger.warning("Item %s failed: %s", item["id"], record["error"])
+            logger.info("Finished %s/%s: %s", succeeded + failed, len(pending), item["id"])
+    finally:
+        # Ctrl-C drops queued items; they are picked up on the next run
+        executor.shutdown(wait=True, cancel_futures=True)
+    return succeeded, failed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate images for a file of prompts without the UI")
+    parser.add_argument("input", help="prompts as .jsonl or .csv with a 'prompt' column")
+    parser.add_argument("--output-dir", default=os.path.join("static", "batch"))
+    parser.add_argument("--manifest", help="manifest path (default: <output-dir>/manifest.jsonl)")
+    parser.add_argument("--generator", default="flux", help="generator for rows that do not name one")
+    parser.add_argument("--upscale", action="store_true", help="also upscale every image")
+    parser.add_argument("--video", action="store_true", help="also make a video from every image")
+    parser.add_argument("--concurrency", type=int, default=4, help="items processed at the same time")
+    parser.add_argument("--deterministic", action="store_true", help="send prompts unchanged and use the cache")
+    parser.add_argument("--hedge", action="store_true", help="race slow requests against a fallback generator")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    import api
+
+    if args.generator not in api.generator_urls:
+        parser.error(f"unknown generator: {args.generator}")
+
+    if args.video:
+        api.prewarm_replicate_models()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = Manifest(args.manifest or os.path.join(args.output_dir, "manifest.jsonl"))
+    items = load_items(args.input, args.generator, upscale=args.upscale, video=args.video)
+
+    start = time.perf_counter()
+    succeeded, failed, skipped = run_batch(
+        api, items, args.output_dir, manifest,
+        concurrency=args.concurrency, deterministic=args.deterministic, hedge=args.hedge
+    )
+    print(
+        f"{succeeded} succeeded, {failed} failed, {skipped} already done "
+        f"in {time.perf_counter() - start:.1f}s; manifest: {manifest.path}"
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Offline benchmark for generate_image, upscale_image and generate_video.
+
+The APIs are replaced by stub_servers.py running in a separate process, so results
+reflect this code's own overhead plus the configured stub latency, without API costs.
+
+    python benchmark.py --scenario all --requests 20 --concurrency 8 --output bench.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_servers import make_png, start_stub_server
+
+
+def run_stub_process(config, url_queue):
+    _, base_url = start_stub_server(config)
+    url_queue.put(base_url)
+    threading.Event().wait()
+
+
+def configure_stub(base_url, **config):
+    request = urllib.request.Request(
+        f"{base_url}/__config", data=json.dumps(config).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    urllib.request.urlopen(request).read()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(1, math.ceil(pct / 100 * len(values))) - 1]
+
+
+class RssSampler:
+    """Samples resident memory in a background thread to find the peak during a stage"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # Without /proc fall back to the process-wide peak (kilobytes on Linux)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.current_rss())
+            self._stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop_event.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.current_rss())
+
+
+def measure(stage, fn, calls, concurrency):
+    """Run fn(i) for i in range(calls) with the given concurrency and summarize latency and resources"""
+    def timed(i):
+        start = time.perf_counter()
+        result = fn(i)
+        ok = isinstance(result, str) and not result.startswith("error")
+        return time.perf_counter() - start, ok
+
+    rss_before = RssSampler.current_rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with RssSampler() as sampler, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(calls)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    latencies = [latency for latency, _ in results]
+    return {
+        "stage": stage,
+        "calls": calls,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in results if not ok),
+        "p50_seconds": percentile(latencies, 50),
+        "p95_seconds": percentile(latencies, 95),
+        "p99_seconds": percentile(latencies, 99),
+        "throughput_per_second": calls / wall if wall else None,
+        "cpu_seconds": cpu,
+        "peak_rss_mb": sampler.peak_bytes / 1024 ** 2,
+        "rss_growth_mb": (sampler.peak_bytes - rss_before) / 1024 ** 2,
+    }
+
+
+def run_scenarios(names, base_url, api, work_dir, requests_per_stage, concurrency):
+    replicate_calls = max(2, requests_per_stage // 4)
+    generators = list(api.generator_urls)
+
+    def session_dir(scenario):
+        path = os.path.join(work_dir, scenario)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def make_inputs(scenario):
+        # One distinct input per call; identical inputs would be coalesced into a single prediction.
+        # Made again for every scenario, so none of them reuses another's prepared uploads.
+        paths = []
+        for i in range(replicate_calls * concurrency):
+            paths.append(os.path.join(session_dir(scenario), f"input_{i}.png"))
+            with open(paths[-1], "wb") as f:
+                f.write(make_png(512 * 1024))
+        return paths
+
+    input_images = {}
+
+    def generate(scenario):
+        return lambda i: api.generate_image(f"benchmark prompt {i}", generators[i % len(generators)], session_dir(scenario))
+
+    def upscale(scenario):
+        return lambda i: api.upscale_image(input_images[scenario][i], session_dir(scenario))
+
+    def video(scenario):
+        return lambda i: api.generate_video(input_images[scenario][i], session_dir(scenario))
+
+    scenarios = {
+        "single": (
+            {"latency": 0.1, "payload_bytes": 256 * 1024, "error_rate": 0.0},
+            [("generate_image", generate, requests_per_stage, 1),
+             ("upscale_image", upscale, replicate_calls, 1),
+             ("generate_video", video, replicate_calls, 1)],
+        ),
+        "concurrent": (
+            {"latency": 0.2, "payload_bytes": 256 * 1024, "error_rate": 0.0},
+            [("generate_image", generate, requests_per_stage * concurrency, concurrency),
+             ("upscale_image", upscale, replicate_calls * concurrency, concurrency)],
+        ),
+        "large_outputs": (
+            {"latency": 0.1, "payload_bytes": 24 * 1024 ** 2, "error_rate": 0.0},
+            [("upscale_image", upscale, replicate_calls, concurrency),
+             ("generate_video", video, replicate_calls, concurrency)],
+        ),
+        "failure_storm": (
+            {"latency": 0.05, "payload_bytes": 256 * 1024, "error_rate": 0.5},
+            [("generate_image", generate, requests_per_stage * concurrency, concurrency),
+             ("upscale_image", upscale, replicate_calls * concurrency, concurrency)],
+        ),
+    }
+
+    results = []
+    for name in names:
+        config, stages = scenarios[name]
+        input_images[name] = make_inputs(name)
+        configure_stub(base_url, **config)
+        for stage, make_fn, calls, stage_concurrency in stages:
+            print(f"Running {name}/{stage}: {calls} calls, concurrency {stage_concurrency}", flush=True)
+            result = measure(stage, make_fn(name), calls, stage_concurrency)
+            result["scenario"] = name
+            results.append(result)
+        shutil.rmtree(session_dir(name), ignore_errors=True)
+    return results
+
+
+def print_report(results):
+    columns = ["scenario", "stage", "calls", "errors", "p50_seconds", "p95_seconds", "p99_seconds",
+               "throughput_per_second", "cpu_seconds", "peak_rss_mb"]
+    headers = ["scenario", "stage", "calls", "err", "p50 s", "p95 s", "p99 s", "ops/s", "cpu s", "peak MB"]
+    rows = [[f"{r[c]:.3f}" if isinstance(r[c], float) else str(r[c]) for c in columns] for r in results]
+    widths = [max(len(h), *(len(row[i]) for row in rows)) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(w) for value, w in zip(row, widths)))
+
+
+def main():
+    scenario_names = ["single", "concurrent", "large_outputs", "failure_storm"]
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against local API stubs")
+    parser.add_argument("--scenario", choices=scenario_names + ["all"], default="all")
+    parser.add_argument("--requests", type=int, default=10, help="calls per stage (per user when concurrent)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    url_queue = multiprocessing.Queue()
+    stub = multiprocessing.Process(target=run_stub_process, args=({}, url_queue), daemon=True)
+    stub.start()
+    base_url = url_queue.get(timeout=30)
+
+    work_dir = tempfile.mkdtemp(prefix="source_studio_bench_")
+    # Point api.py at the stub before it is imported
+    os.environ.update({
+        "HF_INFERENCE_BASE_URL": base_url,
+        "REPLICATE_BASE_URL": base_url,
+        "HUGGINGFACEHUB_API_TOKEN": "stub",
+        "REPLICATE_API_TOKEN": "stub",
+        "GENERATION_CACHE_DIR": os.path.join(work_dir, "cache"),
+        "ASSET_STORE_DIR": os.path.join(work_dir, "assets"),
+    })
+    import api
+
+    try:
+        names = scenario_names if args.scenario == "all" else [args.scenario]
+        results = run_scenarios(names, base_url, api, work_dir, args.requests, args.concurrency)
+    finally:
+        stub.terminate()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from history_store import HistoryStore, history_filename
+from image_codec import encode_image, write_atomic
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Assets in these formats are rewritten as lossless WebP
+compactable_extensions = (".png",)
+
+# Image modes WebP stores without loss; anything else, such as 16-bit PNGs, is left alone
+lossless_webp_modes = ("RGB", "RGBA", "L", "P")
+
+
+def _same_image(source_path, webp_path):
+    """True if the WebP decodes to the same pixels and colour profile as the source"""
+    from PIL import Image
+
+    with Image.open(source_path) as source, Image.open(webp_path) as webp:
+        if source.info.get("icc_profile") != webp.info.get("icc_profile"):
+            return False
+        # WebP has no palette or greyscale mode, so compare both as RGBA
+        return source.size == webp.size and source.convert("RGBA").tobytes() == webp.convert("RGBA").tobytes()
+
+
+class AssetCompactor:
+    """
+    Low-priority background worker that rewrites session images nobody has shown or
+    edited for cold_seconds as lossless WebP and points the session history at the new file.
+    It runs in a niced thread, waits while is_busy() reports live work, and sleeps
+    between files in proportion to the time each one took, capping its duty cycle.
+    """
+
+    def __init__(self, user_files_dir, asset_store=None, cold_seconds=3600, interval=600,
+                 max_files_per_pass=50, duty_cycle=0.25, is_busy=None):
+        self.user_files_dir = user_files_dir
+        self.asset_store = asset_store
+        self.cold_seconds = cold_seconds
+        self.interval = interval
+        self.max_files_per_pass = max_files_per_pass
+        self.duty_cycle = duty_cycle
+        self.is_busy = is_busy or (lambda: False)
+        self.bytes_saved = 0
+        self._rejected = set()  # (path, mtime_ns, size) of files left as they are
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _cold_assets(self):
+        """
+        Yield (session_dir, path) for compactable history entries nobody has shown or edited
+        within cold_seconds. File access times are not used: the history shows thumbnails,
+        so originals are rarely read, and relatime updates atime at most once a day.
+        """
+        cutoff = time.time() - self.cold_seconds
+        with os.scandir(self.user_files_dir) as sessions:
+            session_dirs = [entry.path for entry in sessions if entry.is_dir()]
+        for session_dir in session_dirs:
+            if not os.path.exists(os.path.join(session_dir, history_filename)):
+                continue
+            try:
+                cold_paths = HistoryStore(session_dir).cold_paths(cutoff)
+            except sqlite3.Error as e:
+                logger.warning("Error reading the history of %s: %s", session_dir, e)
+                continue
+            for path in cold_paths:
+                # Only files in the session directory itself; the history stores paths as written
+                path = os.path.join(session_dir, os.path.basename(path))
+                if not path.lower().endswith(compactable_extensions):
+                    continue
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        yield session_dir, path
+                except FileNotFoundError:
+                    continue  # Evicted or cleaned up in the meantime
+
+    def _reject(self, version, stat):
+        # Remembered here rather than by touching the file, which would skew quota eviction;
+        # decoding it may have bumped atime, so put the original back
+        os.utime(version[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self._rejected.add(version)
+        return 0
+
+    def compact(self, session_dir, path):
+        """
+        Rewrite one image as lossless WebP if that makes it smaller. The new file is written,
+        decoded and compared with the original, and the history updated before the original
+        is removed. Images WebP cannot hold losslessly are skipped. Returns the bytes saved.
+        """
+        webp_path = os.path.splitext(path)[0] + ".webp"
+        stat = os.stat(path)
+        old_size = stat.st_size
+        version = (path, stat.st_mtime_ns, old_size)
+        if version in self._rejected:
+            return 0
+
+        # A WebP next to the original means an earlier pass stopped before removing it
+        if not os.path.exists(webp_path):
+            from PIL import Image
+
+            with metrics.timer("compaction", format="webp"):
+                with Image.open(path) as image:
+                    if image.mode not in lossless_webp_modes:
+                        logger.debug("Not compacting %s: WebP cannot hold %s images losslessly", path, image.mode)
+                        return self._reject(version, stat)
+                    encoded = encode_image(
+                        image, "webp", icc_profile=image.info.get("icc_profile"), exif=image.info.get("exif")
+                    )
+            if len(encoded) >= old_size:
+                return self._reject(version, stat)
+
+            write_atomic(encoded, webp_path)
+            # Keep the original timestamps so the quota and janitor see the same access pattern
+            os.utime(webp_path, (stat.st_atime, stat.st_mtime))
+
+        if not _same_image(path, webp_path):
+            logger.warning("WebP copy of %s does not match the original, keeping the PNG", path)
+            os.remove(webp_path)
+            return self._reject(version, stat)
+
+        if os.path.exists(os.path.join(session_dir, history_filename)):
+            HistoryStore(session_dir).replace_path(path, webp_path)
+        os.remove(path)
+        if self.asset_store is not None:
+            self.asset_store.adopt(webp_path)
+
+        saved = old_size - os.path.getsize(webp_path)
+        self.bytes_saved += saved
+        logger.info("Compacted %s to WebP, saved %s bytes", path, saved)
+        return saved
+
+    def run_once(self):
+        """Compact up to max_files_per_pass cold assets. Returns the number of files rewritten."""
+        compacted = 0
+        # Forget rejected files that no longer exist
+        self._rejected = {version for version in self._rejected if os.path.exists(version[0])}
+        for session_dir, path in self._cold_assets():
+            if compacted >= self.max_files_per_pass or self._stop_event.is_set():
+                break
+            while self.is_busy() and not self._stop_event.is_set():
+                self._stop_event.wait(5)
+
+            start = time.perf_counter()
+            try:
+                if self.compact(session_dir, path):
+                    compacted += 1
+            except FileNotFoundError:
+                continue  # Evicted or cleaned up while being compacted
+            except OSError as e:
+                logger.warning("Error compacting %s: %s", path, e)
+            elapsed = time.perf_counter() - start
+            self._stop_event.wait(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+        return compacted
+
+    def start(self):
+        """Start compacting in a low-priority daemon thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+
+        def run():
+            try:
+                # Lower the CPU priority of this thread only; Linux schedules threads individually
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except (AttributeError, OSError) as e:
+                logger.debug("Could not lower compaction thread priority: %s", e)
+            while not self._stop_event.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error("Error during asset compaction: %s", e)
+                self._stop_event.wait(self.interval)
+
+        self._thread = threading.Thread(target=run, name="asset-compactor", daemon=True)
+        self._thread.start()
+        logger.info("Started asset compactor")
+
+    def stop(self):
+        """Stop the compactor thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """Raised when a download fails, exceeds the size limit or cannot be resumed"""
+
+
+def _range_start(content_range):
+    """Return the first byte offset from a Content-Range header, or None"""
+    match = re.match(r"bytes (\d+)-", content_range or "")
+    return int(match.group(1)) if match else None
+
+
+def stream_download(url, dest_path, session=None, max_bytes=None, chunk_size=256 * 1024,
+                    retries=3, timeout=(10, 60)):
+    """
+    Stream url to dest_path without holding the body in memory.
+    Chunks are written to a temporary file next to dest_path and hashed as they arrive.
+    Dropped connections are resumed with a Range request, and the file is renamed into
+    place only once complete, so a failed transfer never leaves a partial file behind.
+    Returns the SHA-256 hex digest of the downloaded data.
+    """
+    session = session or requests.Session()
+    dest_dir = os.path.dirname(dest_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".download_", suffix=".part")
+
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            digest = hashlib.sha256()
+            received = 0
+
+            for attempt in range(retries + 1):
+                headers = {"Range": f"bytes={received}-"} if received else {}
+                try:
+                    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                        response.raise_for_status()
+
+                        # Start over if the server ignored the range or resumed at the wrong offset
+                        if received and (response.status_code != 206
+                                         or _range_start(response.headers.get("Content-Range")) != received):
+                            logger.warning("Server did not honor the range request, restarting download")
+                            tmp_file.seek(0)
+                            tmp_file.truncate()
+                            digest = hashlib.sha256()
+                            received = 0
+
+                        content_length = response.headers.get("Content-Length")
+                        if max_bytes and content_length and received + int(content_length) > max_bytes:
+                            raise DownloadError(f"Download exceeds maximum size of {max_bytes} bytes")
+
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if max_bytes and received + len(chunk) > max_bytes:
+                                raise DownloadError(f"Download exceeds maximum size of {max_bytes} bytes")
+                            tmp_file.write(chunk)
+                            digest.update(chunk)
+                            received += len(chunk)
+                    break
+
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout) as e:
+                    if attempt == retries:
+                        raise DownloadError(f"Download failed after {retries + 1} attempts: {e}") from e
+                    delay = min(2 ** attempt, 10)
+                    logger.warning("Download interrupted at %s bytes (%s), resuming in %s seconds", received, e, delay)
+                    time.sleep(delay)
+
+        os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+        os.replace(tmp_path, dest_path)
+        logger.info("Downloaded %s bytes to %s", received, dest_path)
+        return digest.hexdigest()
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
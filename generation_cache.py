@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """
+    On-disk cache of generation outputs keyed by the content of the request.
+    Entries are evicted least-recently-used first once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (path, size), least recently used first
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(operation, model, prompt=None, params=None, input_hash=None):
+        """Build a cache key from the operation, model, normalized prompt, params and input hash"""
+        normalized_prompt = " ".join(prompt.split()) if prompt else None
+        payload = json.dumps(
+            {
+                "operation": operation,
+                "model": model,
+                "prompt": normalized_prompt,
+                "params": params,
+                "input": input_hash,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """Index existing cache files, oldest modification time first"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+
+        for _, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+        self._loaded = True
+        logger.info("Loaded generation cache with %s entries (%s bytes)", len(self._entries), self._total_bytes)
+
+    def restore(self, key, dest_path):
+        """
+        Copy the cached output for key to dest_path and return the restored path, or None on a miss.
+        If dest_path has no extension, the extension of the cached file is appended.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                self.misses += 1
+                return None
+
+            if not os.path.splitext(dest_path)[1]:
+                dest_path += os.path.splitext(entry[0])[1]
+            shutil.copyfile(entry[0], dest_path)
+            self._entries.move_to_end(key)
+            os.utime(entry[0])  # Keep LRU order across restarts
+            self.hits += 1
+            logger.info("Generation cache hit: %s", key)
+            return dest_path
+
+    def put(self, key, src_path):
+        """Store a copy of src_path under key and evict old entries if over budget"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            ext = os.path.splitext(src_path)[1]
+            cache_path = os.path.join(self.cache_dir, f"{key}{ext}")
+
+            # Copy to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp_")
+            try:
+                with os.fdopen(fd, "wb") as tmp_file, open(src_path, "rb") as src_file:
+                    shutil.copyfileobj(src_file, tmp_file)
+                os.replace(tmp_path, cache_path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._total_bytes -= old_entry[1]
+            size = os.path.getsize(cache_path)
+            self._entries[key] = (cache_path, size)
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (path, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+                logger.info("Evicted generation cache entry: %s", key)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Return hit/miss counters and current usage"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,94 @@
+import logging
+import math
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Keeps a rolling window of recent latencies per key and reports percentiles"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def percentile(self, key, pct, default=None):
+        """Return the pct-th percentile latency for key, or default if there are too few samples"""
+        with self._lock:
+            samples = sorted(self._samples[key])
+        if len(samples) < self.min_samples:
+            return default
+        rank = max(1, math.ceil(pct / 100 * len(samples)))
+        return samples[rank - 1]
+
+
+class HedgeStats:
+    """Counts how often requests were hedged and which attempt won, per generator"""
+
+    def __init__(self):
+        self._counts = defaultdict(lambda: {"calls": 0, "hedged": 0, "primary_wins": 0, "hedge_wins": 0, "failures": 0})
+        self._lock = threading.Lock()
+
+    def record(self, key, hedged, winner):
+        with self._lock:
+            counts = self._counts[key]
+            counts["calls"] += 1
+            if hedged:
+                counts["hedged"] += 1
+            if winner is None:
+                counts["failures"] += 1
+            else:
+                counts[f"{winner}_wins"] += 1
+
+    def snapshot(self):
+        """Return a copy of the counters with the hedge rate for each key"""
+        with self._lock:
+            snapshot = {key: dict(counts) for key, counts in self._counts.items()}
+        for counts in snapshot.values():
+            counts["hedge_rate"] = counts["hedged"] / counts["calls"] if counts["calls"] else 0.0
+        return snapshot
+
+
+def run_hedged(primary, hedge, deadline, executor, can_hedge=None):
+    """
+    Run primary and, if it has not finished within deadline seconds, start hedge as well.
+    Both callables receive a threading.Event that is set when the other attempt wins,
+    and should return a falsy value on failure. The first successful result wins.
+    If can_hedge() returns False at the deadline, the hedge is skipped and primary awaited alone.
+    Returns (result, winner, hedged) where winner is "primary", "hedge" or None.
+    """
+    cancel_events = {"primary": threading.Event(), "hedge": threading.Event()}
+    primary_future = executor.submit(primary, cancel_events["primary"])
+    done, _ = wait([primary_future], timeout=deadline)
+    if done:
+        result = primary_future.result()
+        return result, ("primary" if result else None), False
+
+    if can_hedge is not None and not can_hedge():
+        logger.info("Primary request exceeded %.1fs deadline, but there is no capacity to hedge", deadline)
+        result = primary_future.result()
+        return result, ("primary" if result else None), False
+
+    logger.info("Primary request exceeded %.1fs deadline, sending hedge request", deadline)
+    hedge_future = executor.submit(hedge, cancel_events["hedge"])
+    names = {primary_future: "primary", hedge_future: "hedge"}
+
+    pending = set(names)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result:
+                # Stop the losing attempt; a request already on the wire is simply discarded
+                for other in pending:
+                    cancel_events[names[other]].set()
+                    other.cancel()
+                return result, names[future], True
+    return None, None, True
@@ -0,0 +1,126 @@
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Name of the history database inside a session directory
+history_filename = ".history.db"
+
+
+class HistoryStore:
+    """
+    Conversation history of one session, kept in SQLite next to the session's assets
+    so it survives browser refreshes. Entries are (prompt, path) pairs in insertion
+    order; each asset appears at most once and can be looked up by name through an index.
+    An asset that was rewritten under a new name can still be found by its previous name.
+    Each entry records when it was last shown or edited, which decides when it counts as cold.
+    """
+
+    def __init__(self, session_dir, filename=history_filename):
+        self.db_path = os.path.join(session_dir, filename)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT NOT NULL, path TEXT NOT NULL, "
+                "asset_name TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Added after the first release of the table, so older databases are migrated here
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(history)")]
+            if "previous_name" not in columns:
+                conn.execute("ALTER TABLE history ADD COLUMN previous_name TEXT")
+            if "last_viewed" not in columns:
+                conn.execute("ALTER TABLE history ADD COLUMN last_viewed REAL")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_history_asset_name ON history (asset_name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_previous_name ON history (previous_name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_prompt ON history (prompt)")
+
+    @contextmanager
+    def _connect(self):
+        # One connection per transaction: committed, or rolled back on error, and then closed
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, prompt, path):
+        """Append an entry unless the asset is already in the history. Returns True if it was added."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO history (prompt, path, asset_name, created_at, last_viewed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (prompt, path, os.path.basename(path), now, now)
+            )
+        return cursor.rowcount > 0
+
+    def get(self, asset_name):
+        """Return the (prompt, path) entry for an asset name, or (None, None) if it is unknown"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT prompt, path FROM history WHERE asset_name = ?", (asset_name,)
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    "SELECT prompt, path FROM history WHERE previous_name = ?", (asset_name,)
+                ).fetchone()
+        return row if row else (None, None)
+
+    def replace_path(self, old_path, new_path):
+        """Point the entry for old_path at new_path in one transaction. Returns True if an entry changed."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE history SET path = ?, asset_name = ?, previous_name = asset_name WHERE asset_name = ?",
+                (new_path, os.path.basename(new_path), os.path.basename(old_path))
+            )
+        return cursor.rowcount > 0
+
+    def remove(self, paths):
+        """Delete the entries of the given assets in one transaction. Returns the number removed."""
+        with self._connect() as conn:
+            cursor = conn.executemany(
+                "DELETE FROM history WHERE asset_name = ?", [(os.path.basename(path),) for path in paths]
+            )
+        return cursor.rowcount
+
+    def mark_viewed(self, paths, resolution=60):
+        """
+        Record that the given assets were shown or edited just now. Entries marked within
+        the last resolution seconds are left alone, so most reruns do not write at all.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE history SET last_viewed = ? WHERE asset_name = ? AND COALESCE(last_viewed, 0) < ?",
+                [(now, os.path.basename(path), now - resolution) for path in paths]
+            )
+
+    def cold_paths(self, cutoff):
+        """Return the paths of entries not shown or edited since the cutoff timestamp"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT path FROM history WHERE COALESCE(last_viewed, created_at) < ? ORDER BY id", (cutoff,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def find_by_prompt(self, prompt):
+        """Return the entries created from a prompt, oldest first"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT prompt, path FROM history WHERE prompt = ? ORDER BY id", (prompt,)
+            ).fetchall()
+
+    def page(self, offset, limit):
+        """Return up to limit entries starting at position offset, oldest first"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT prompt, path FROM history ORDER BY id LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
@@ -0,0 +1,101 @@
+import io
+import logging
+import os
+import tempfile
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# File extension used for each supported output format
+format_extensions = {
+    "png": ".png",
+    "jpeg": ".jpg",
+    "webp": ".webp",
+    "gif": ".gif",
+}
+
+
+def sniff_format(data):
+    """Identify an image format from its header bytes without decoding it"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def write_atomic(data, dest_path):
+    """Write bytes to a temporary file and rename it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path) or ".", prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates owner-only files
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def encode_image(image, target_format, png_compress_level=6, quality=None, icc_profile=None, exif=None):
+    """
+    Encode a PIL image to bytes. WebP is lossless, down to the colour of fully transparent
+    pixels, unless a quality is given. icc_profile and exif are embedded when given.
+    """
+    buffer = io.BytesIO()
+    metadata = {name: value for name, value in (("icc_profile", icc_profile), ("exif", exif)) if value}
+    if target_format == "webp" and quality is not None:
+        image.save(buffer, format="WEBP", quality=quality, **metadata)
+    elif target_format == "webp":
+        image.save(buffer, format="WEBP", lossless=True, exact=True, **metadata)
+    elif target_format == "png":
+        image.save(buffer, format="PNG", compress_level=png_compress_level, **metadata)
+    else:
+        image.save(buffer, format=target_format.upper(), **metadata)
+    return buffer.getvalue()
+
+
+def _reencode(data, dest_path, target_format, png_compress_level):
+    # PIL is imported on first use so that importing this module stays cheap
+    from PIL import Image
+
+    with metrics.timer("encode", format=target_format):
+        with Image.open(io.BytesIO(data)) as image:
+            encoded = encode_image(image, target_format, png_compress_level)
+    with metrics.timer("disk_write", format=target_format):
+        write_atomic(encoded, dest_path)
+
+
+def save_image_bytes(data, dest_base, codec="png", png_compress_level=6):
+    """
+    Save an encoded image payload to dest_base plus the extension of the output format.
+    codec is "png", "webp" (lossless) or "native" to keep whatever format was received.
+    Payloads already in the target format are written as-is; anything else is
+    re-encoded inline on the calling thread, which is a worker (generate_images,
+    background jobs, batch workers) rather than the Streamlit script thread.
+    png_compress_level only applies when a payload is re-encoded to PNG; PNGs
+    received from the API keep their original compression.
+    Returns the saved path.
+    """
+    source_format = sniff_format(data)
+    if source_format is None:
+        raise ValueError("Payload is not a supported image format")
+
+    target_format = source_format if codec == "native" else codec
+    if target_format not in format_extensions:
+        raise ValueError(f"Unsupported output codec: {codec}")
+    dest_path = dest_base + format_extensions[target_format]
+
+    if source_format == target_format:
+        logger.debug("Writing %s payload directly to %s", source_format, dest_path)
+        with metrics.timer("disk_write", format=target_format):
+            write_atomic(data, dest_path)
+    else:
+        logger.debug("Re-encoding %s payload as %s", source_format, target_format)
+        _reencode(data, dest_path, target_format, png_compress_level)
+    return dest_path
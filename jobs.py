@@ -0,0 +1,126 @@
+import inspect
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Job status values
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, job_id, label):
+        self.id = job_id
+        self.label = label
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        """Whether the job has reached a final status"""
+        return self.status in (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobManager:
+    """
+    Runs long API calls (upscaling, video generation) on a background worker pool.
+    Jobs are tracked by ID so a Streamlit script can submit work, return immediately
+    and pick up the result on a later rerun.
+    """
+
+    def __init__(self, max_workers=4, retention_seconds=3600):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, label=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) and return the new job ID.
+        If fn accepts a cancel_event argument, the job's cancel event is passed to it
+        so a running call can stop early when the job is cancelled.
+        """
+        job = Job(uuid.uuid4().hex, label or fn.__name__)
+        if "cancel_event" in inspect.signature(fn).parameters:
+            kwargs["cancel_event"] = job.cancel_event
+
+        with self._lock:
+            self._prune_finished()
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info("Queued job %s: %s", job.id, job.label)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+
+        job.status = RUNNING
+        logger.info("Running job %s: %s", job.id, job.label)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.error("Job %s raised an error: %s", job.id, e)
+            self._finish(job, FAILED, error=str(e))
+            return
+
+        # The API functions report failures as "error: ..." strings rather than raising
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+        elif isinstance(result, str) and result.startswith("error"):
+            self._finish(job, FAILED, error=result)
+        else:
+            self._finish(job, SUCCEEDED, result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.status = status
+        logger.info("Job %s finished with status: %s", job.id, status)
+
+    def _prune_finished(self):
+        """Drop finished jobs nobody collected within the retention window"""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None if it is unknown"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def has_active_jobs(self):
+        """Whether any job is queued or running"""
+        with self._lock:
+            return any(not job.done for job in self._jobs.values())
+
+    def pop(self, job_id):
+        """Remove a job and return it, used to hand off the result once it is consumed"""
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """Request cancellation of a job. Queued jobs are cancelled immediately."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        logger.info("Cancellation requested for job %s", job.id)
+        return True
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Resolves Replicate model versions through one shared client and keeps the handles
+    for ttl seconds, so predictions do not pay for model and version lookups every time.
+    The client is built on first use by client_factory.
+    """
+
+    def __init__(self, client_factory, ttl=3600):
+        self.ttl = ttl
+        self._client_factory = client_factory
+        self._client = None
+        self._versions = {}  # (model name, version id) -> (expires_at, version)
+        self._resolving = SingleFlight()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The shared Replicate client"""
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def _resolve(self, model_name, version_id):
+        model = self.client.models.get(model_name)
+        version = model.versions.get(version_id)
+        logger.info("Resolved Replicate model %s version %s", model_name, version_id)
+        return version
+
+    def get_version(self, model_name, version_id):
+        """
+        Return the version handle for a model, looking it up only when it is missing or expired.
+        If a refresh fails, the expired handle is returned rather than failing the request.
+        """
+        key = (model_name, version_id)
+        with self._lock:
+            entry = self._versions.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        try:
+            version, _ = self._resolving.do(key, lambda _: self._resolve(model_name, version_id))
+        except Exception as e:
+            if entry is None:
+                raise
+            logger.warning("Error refreshing %s version %s, using cached handle: %s", model_name, version_id, e)
+            return entry[1]
+
+        with self._lock:
+            self._versions[key] = (time.monotonic() + self.ttl, version)
+        return version
+
+    def prewarm(self, models):
+        """Resolve (model name, version id) pairs in a daemon thread so the first request finds them cached"""
+        def run():
+            for model_name, version_id in models:
+                try:
+                    self.get_version(model_name, version_id)
+                except Exception as e:
+                    logger.warning("Error pre-warming Replicate model %s: %s", model_name, e)
+
+        thread = threading.Thread(target=run, name="model-registry-prewarm", daemon=True)
+        thread.start()
+        return thread
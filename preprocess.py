@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from image_codec import encode_image, write_atomic
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Formats that are already compact; re-encoding them losslessly only makes them bigger
+compact_formats = ("JPEG", "WEBP")
+
+
+def cover_size(size, target):
+    """Smallest size with the same aspect ratio that still covers target, or None if size already fits"""
+    width, height = size
+    scale = max(target[0] / width, target[1] / height)
+    if scale >= 1:
+        return None
+    return max(target[0], round(width * scale)), max(target[1], round(height * scale))
+
+
+def _prepare(source_path, dest_path, target):
+    """
+    Build the upload payload for one source image. Returns dest_path, or None when
+    the source is already the smallest thing worth sending.
+    """
+    from PIL import Image
+
+    with Image.open(source_path) as image:
+        source_format = image.format
+        new_size = cover_size(image.size, target) if target else None
+        if new_size is None and source_format in compact_formats:
+            return None
+
+        # The models read their input as RGB, so other modes only add bytes
+        prepared = image if image.mode == "RGB" else image.convert("RGB")
+        if new_size is not None:
+            prepared = prepared.resize(new_size, Image.LANCZOS)
+        encoded = encode_image(prepared, "png", png_compress_level=9)
+
+    if new_size is None and len(encoded) >= os.path.getsize(source_path):
+        return None
+    write_atomic(encoded, dest_path)
+    return dest_path
+
+
+class InputPreparer:
+    """
+    Shrinks images before they are uploaded to Replicate, memoized per source content hash.
+    Images are downscaled to the smallest size that still covers the model's working
+    resolution and re-encoded losslessly; anything that would not get smaller is sent as-is.
+    Prepared files are kept in cache_dir and evicted least-recently-used first once
+    they take up more than max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 ** 2, max_entries=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._memo = OrderedDict()  # (profile, source hash, target) -> payload path, least recently used first
+        self._files = OrderedDict()  # prepared file path -> size, least recently used first
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Index prepared files left by earlier runs, oldest modification time first"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(files):
+            self._files[path] = size
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+        logger.info("Loaded %s prepared inputs (%s bytes)", len(self._files), self._total_bytes)
+
+    def prepare(self, source_path, source_hash, profile, target=None):
+        """
+        Return the path of the file to upload for source_path.
+        profile names the model the payload is for; target is the (width, height) the model
+        works at, or None if it uses the input resolution.
+        """
+        key = (profile, source_hash, target)
+        size_tag = f"{target[0]}x{target[1]}" if target else "original"
+        dest_path = os.path.join(self.cache_dir, f"{profile}_{size_tag}_{source_hash}.png")
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            payload_path = self._memo.get(key)
+            if payload_path is None and dest_path in self._files:
+                payload_path = dest_path  # Prepared by an earlier run
+            if payload_path is not None and os.path.exists(payload_path):
+                self._remember(key, payload_path)
+                metrics.cache_lookups_total.inc(operation="prepare_input", result="hit")
+                return payload_path
+
+        metrics.cache_lookups_total.inc(operation="prepare_input", result="miss")
+        with metrics.timer("prepare_input", profile=profile):
+            prepared_path = _prepare(source_path, dest_path, target)
+        payload_path = prepared_path or source_path
+
+        if prepared_path:
+            logger.info(
+                "Prepared %s upload: %s bytes instead of %s",
+                profile, os.path.getsize(prepared_path), os.path.getsize(source_path)
+            )
+        with self._lock:
+            if prepared_path:
+                self._total_bytes -= self._files.pop(prepared_path, 0)
+                self._files[prepared_path] = os.path.getsize(prepared_path)
+                self._total_bytes += self._files[prepared_path]
+            self._remember(key, payload_path)
+            self._evict()
+        return payload_path
+
+    def _remember(self, key, payload_path):
+        self._memo[key] = payload_path
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.max_entries:
+            self._memo.popitem(last=False)
+        if payload_path in self._files:
+            self._files.move_to_end(payload_path)
+            os.utime(payload_path)  # Keep LRU order across restarts
+
+    def _evict(self):
+        # The newest file stays even if it alone is over budget, as it is about to be uploaded
+        while self._total_bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+                logger.info("Evicted prepared input %s", path)
+            except FileNotFoundError:
+                pass
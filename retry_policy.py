@@ -0,0 +1,62 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given in seconds or as an HTTP date. Returns seconds or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Decides whether and how long to wait before retrying a Hugging Face inference request.
+    Cold models (503 with estimated_time) are waited for, rate limits honor Retry-After,
+    and other transient failures use exponential backoff with full jitter.
+    """
+
+    # Statuses worth retrying; anything else is treated as a hard error
+    retryable_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=30.0, max_total_wait=180.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total_wait = max_total_wait
+
+    def backoff(self, attempt):
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def delay_for(self, response, attempt):
+        """
+        Return the number of seconds to wait before the next attempt, or None if the
+        request should not be retried. response is None for connection errors and timeouts.
+        """
+        if response is None:
+            return self.backoff(attempt)
+        if response.status_code not in self.retryable_statuses:
+            return None
+
+        if response.status_code == 503:
+            # "Model is loading" responses say how long loading is expected to take
+            try:
+                estimated_time = float(response.json().get("estimated_time"))
+            except (ValueError, TypeError, AttributeError):
+                estimated_time = None
+            if estimated_time is not None:
+                return min(self.max_delay, estimated_time * random.uniform(1.0, 1.2))
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return self.backoff(attempt)
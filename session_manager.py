@@ -1,39 +1,204 @@
 import os
 import time
 import shutil
+import sqlite3
 import logging
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+
+from history_store import HistoryStore, history_filename
+
+logger = logging.getLogger(__name__)
 
 class SessionManager:
-    def __init__(self, base_dir="static", expiration_hours=24):
+    def __init__(self, base_dir="static", expiration_hours=24, quota_mb=None, touch_interval=60, asset_store=None):
         self.base_dir = base_dir
+        self.user_files_dir = os.path.join(base_dir, "user_files")
         self.expiration_seconds = expiration_hours * 3600
+        self.quota_bytes = quota_mb * 1024 * 1024 if quota_mb else None
+        self.touch_interval = touch_interval
+        self.asset_store = asset_store  # Its unreferenced blobs are collected after each janitor pass
+        self.index_path = os.path.join(base_dir, "sessions.db")
+        self._last_touch = {}  # session_id -> last time the index was updated
+        self._active_sessions = set()  # sessions touched since the last quota check
+        self._lock = threading.Lock()
+        self._janitor = None
+        self._stop_event = threading.Event()
         self._init_directories()
-        
+        self._init_index()
+
     def _init_directories(self):
         """Initialize the base directory structure"""
         os.makedirs(self.base_dir, exist_ok=True)
-        os.makedirs(os.path.join(self.base_dir, "user_files"), exist_ok=True)
-        
+        os.makedirs(self.user_files_dir, exist_ok=True)
+
+    @contextmanager
+    def _connect(self):
+        # One connection per transaction: committed, or rolled back on error, and then closed
+        conn = sqlite3.connect(self.index_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_index(self):
+        """Create the session index recording creation and last access times"""
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions (last_access)")
+
     def get_session_dir(self, session_id):
         """Get or create session directory"""
-        session_dir = os.path.join(self.base_dir, "user_files", session_id)
+        session_dir = os.path.join(self.user_files_dir, session_id)
         os.makedirs(session_dir, exist_ok=True)
+        self.touch(session_id)
         return session_dir
-        
-    def cleanup_expired_sessions(self):
-        """Remove expired session directories"""
-        current_time = time.time()
-        user_files_dir = os.path.join(self.base_dir, "user_files")
-        
-        for session_id in os.listdir(user_files_dir):
-            session_dir = os.path.join(user_files_dir, session_id)
-            if os.path.isdir(session_dir):
-                # Check directory age
-                dir_age = current_time - os.path.getctime(session_dir)
-                if dir_age > self.expiration_seconds:
-                    try:
-                        shutil.rmtree(session_dir)
-                        logging.info(f"Cleaned up expired session: {session_id}")
-                    except Exception as e:
-                        logging.error(f"Error cleaning up session {session_id}: {e}") 
\ No newline at end of file
+
+    def touch(self, session_id):
+        """Record an access to a session. Index writes are limited to one per touch_interval."""
+        now = time.time()
+        with self._lock:
+            self._active_sessions.add(session_id)
+            if now - self._last_touch.get(session_id, 0) < self.touch_interval:
+                return
+            self._last_touch[session_id] = now
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                (session_id, now, now)
+            )
+
+    def _register_untracked_sessions(self):
+        """Add session directories created before the index existed, using their ctime"""
+        with self._connect() as conn:
+            known = {row[0] for row in conn.execute("SELECT session_id FROM sessions")}
+            for session_id in os.listdir(self.user_files_dir):
+                session_dir = os.path.join(self.user_files_dir, session_id)
+                if session_id not in known and os.path.isdir(session_dir):
+                    created_at = os.path.getctime(session_dir)
+                    conn.execute(
+                        "INSERT OR IGNORE INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?)",
+                        (session_id, created_at, created_at)
+                    )
+                    logger.info("Registered untracked session: %s", session_id)
+
+    def cleanup_expired_sessions(self, batch_size=None):
+        """Remove session directories not accessed within the expiration period. Returns the number removed."""
+        cutoff = time.time() - self.expiration_seconds
+        with self._connect() as conn:
+            query = "SELECT session_id FROM sessions WHERE last_access < ? ORDER BY last_access"
+            params = (cutoff,)
+            if batch_size:
+                query += " LIMIT ?"
+                params = (cutoff, batch_size)
+            expired = [row[0] for row in conn.execute(query, params)]
+
+        removed = 0
+        for session_id in expired:
+            session_dir = os.path.join(self.user_files_dir, session_id)
+            try:
+                if os.path.isdir(session_dir):
+                    shutil.rmtree(session_dir)
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                with self._lock:
+                    self._last_touch.pop(session_id, None)
+                removed += 1
+                logger.info("Cleaned up expired session: %s", session_id)
+            except Exception as e:
+                logger.error("Error cleaning up session %s: %s", session_id, e)
+        return removed
+
+    def _session_assets(self, session_id):
+        """List (last_used, size, path) for the visible files of a session"""
+        session_dir = os.path.join(self.user_files_dir, session_id)
+        assets = []
+        with os.scandir(session_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                assets.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+        return assets
+
+    def enforce_quota(self, session_id):
+        """Delete the least recently used assets of a session until it fits within the quota"""
+        if not self.quota_bytes:
+            return 0
+        try:
+            assets = sorted(self._session_assets(session_id))
+        except FileNotFoundError:
+            return 0
+
+        usage = sum(size for _, size, _ in assets)
+        removed = []
+        for _, size, path in assets:
+            if usage <= self.quota_bytes:
+                break
+            try:
+                os.remove(path)
+                usage -= size
+                removed.append(path)
+                logger.info("Evicted %s to keep session %s within quota", path, session_id)
+            except FileNotFoundError:
+                pass
+
+        # Drop the history entries too, so the session does not list images that are gone
+        session_dir = os.path.join(self.user_files_dir, session_id)
+        if removed and os.path.exists(os.path.join(session_dir, history_filename)):
+            HistoryStore(session_dir).remove(removed)
+        return len(removed)
+
+    def run_janitor_pass(self, batch_size=20, batch_pause=1.0):
+        """
+        Remove expired sessions in rate-limited batches, then enforce quotas of active sessions
+        and drop asset store blobs that no session links to any more
+        """
+        while not self._stop_event.is_set():
+            if self.cleanup_expired_sessions(batch_size=batch_size) < batch_size:
+                break
+            self._stop_event.wait(batch_pause)
+
+        with self._lock:
+            active_sessions = list(self._active_sessions)
+            self._active_sessions.clear()
+        for session_id in active_sessions:
+            self.enforce_quota(session_id)
+
+        if self.asset_store is not None:
+            self.asset_store.collect_garbage()
+
+    def start_janitor(self, interval=300, batch_size=20, batch_pause=1.0):
+        """Start a background thread that periodically runs the janitor"""
+        if self._janitor is not None:
+            return
+        self._stop_event.clear()
+
+        def run():
+            try:
+                self._register_untracked_sessions()
+            except Exception as e:
+                logger.error("Error registering existing sessions: %s", e)
+            while not self._stop_event.is_set():
+                try:
+                    self.run_janitor_pass(batch_size=batch_size, batch_pause=batch_pause)
+                except Exception as e:
+                    logger.error("Error during session cleanup: %s", e)
+                self._stop_event.wait(interval)
+
+        self._janitor = threading.Thread(target=run, name="session-janitor", daemon=True)
+        self._janitor.start()
+        logger.info("Started session janitor")
+
+    def stop_janitor(self):
+        """Stop the janitor thread"""
+        self._stop_event.set()
+        if self._janitor is not None:
+            self._janitor.join()
+            self._janitor = None
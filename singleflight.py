@@ -0,0 +1,81 @@
+import logging
+import threading
+from concurrent.futures import CancelledError, Future, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.future = Future()
+        self.waiters = 0
+        # Set once every waiter has given up, telling the running function to stop
+        self.cancel_event = threading.Event()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key so only one of them does the work.
+    The work runs in its own thread; every caller, including the first, waits for it
+    and receives the same result (or exception). A caller whose cancel_event is set
+    stops waiting, and the work itself is only cancelled once all callers have left.
+    """
+
+    def __init__(self, poll_interval=0.2):
+        self.poll_interval = poll_interval
+        self._calls = {}  # key -> _Call of the running work
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, cancel_event=None):
+        """
+        Run fn(cancel_event) for key unless an identical call is in flight, and wait for it.
+        Returns (result, shared). Raises CancelledError if this caller's cancel_event is set first.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = _Call()
+                self._calls[key] = call
+                threading.Thread(target=self._run, args=(key, call, fn), name="singleflight", daemon=True).start()
+            call.waiters += 1
+
+        if shared:
+            logger.info("Joining in-flight call for key %s", key)
+        return self._wait(key, call, cancel_event), shared
+
+    def _run(self, key, call, fn):
+        try:
+            call.future.set_result(fn(call.cancel_event))
+        except BaseException as e:
+            call.future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def _wait(self, key, call, cancel_event):
+        if cancel_event is None:
+            return call.future.result()
+
+        while True:
+            try:
+                return call.future.result(timeout=self.poll_interval)
+            except TimeoutError:
+                if not cancel_event.is_set():
+                    continue
+
+            with self._lock:
+                call.waiters -= 1
+                if call.waiters == 0:
+                    # Nobody wants the result any more; new callers start fresh work
+                    call.cancel_event.set()
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                    logger.info("All callers left in-flight call for key %s, cancelling it", key)
+            raise CancelledError()
+
+    def in_flight(self):
+        """Number of distinct calls currently running"""
+        with self._lock:
+            return len(self._calls)
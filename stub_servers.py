@@ -0,0 +1,261 @@
+"""
+Local stand-ins for the Hugging Face inference API and the Replicate API, used by
+benchmark.py to measure the generation pipeline without spending API credits.
+
+A single HTTP server answers both APIs:
+- POST /models/<name> mimics the Hugging Face inference endpoints
+- /v1/models, /v1/files and /v1/predictions mimic the Replicate HTTP API
+- GET /outputs/<file> serves prediction outputs, with Range support for resumed downloads
+- POST /__config updates latency, payload size and error injection at runtime
+"""
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+default_config = {
+    "latency": 0.1,  # seconds before an HF response or a prediction completes
+    "jitter": 0.05,  # extra random latency, uniformly distributed
+    "payload_bytes": 256 * 1024,  # approximate size of generated images and videos
+    "error_rate": 0.0,  # probability that a request fails
+    "error_statuses": [503, 429, 500],  # HF error responses picked at random
+    "estimated_time": 0.2,  # estimated_time reported with 503 "model is loading" errors
+}
+
+
+def make_png(payload_bytes):
+    """Create a PNG of roughly payload_bytes from random noise, which does not compress"""
+    side = max(8, int((payload_bytes / 3) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_mp4(payload_bytes):
+    """Create a payload with an MP4 header followed by random data"""
+    return b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom" + os.urandom(payload_bytes)
+
+
+class StubState:
+    def __init__(self, config):
+        self.config = dict(default_config, **config)
+        self.predictions = {}
+        self.outputs = {}  # output name -> bytes
+        self._payloads = {}
+        self.lock = threading.Lock()
+
+    def payload(self, kind):
+        """Return a cached payload of the configured size"""
+        key = (kind, self.config["payload_bytes"])
+        with self.lock:
+            if key not in self._payloads:
+                make = make_mp4 if kind == "mp4" else make_png
+                self._payloads[key] = make(self.config["payload_bytes"])
+            return self._payloads[key]
+
+    def latency(self):
+        return self.config["latency"] + random.uniform(0, self.config["jitter"])
+
+    def should_fail(self):
+        return random.random() < self.config["error_rate"]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def base_url(self):
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Hugging Face inference API
+
+    def _hf_generate(self):
+        self._read_body()
+        time.sleep(self.state.latency())
+        if self.state.should_fail():
+            status = random.choice(self.state.config["error_statuses"])
+            if status == 503:
+                self._send(503, {"error": "Model is loading", "estimated_time": self.state.config["estimated_time"]})
+            elif status == 429:
+                self._send(429, {"error": "Rate limit reached"}, headers={"Retry-After": "0.1"})
+            else:
+                self._send(status, {"error": "Internal error"})
+            return
+        self._send(200, self.state.payload("png"), content_type="image/png")
+
+    # Replicate API
+
+    def _model_json(self, owner, name):
+        return {
+            "url": f"{self.base_url}/{owner}/{name}", "owner": owner, "name": name,
+            "description": "Benchmark stub", "visibility": "public", "github_url": None,
+            "paper_url": None, "license_url": None, "run_count": 0, "cover_image_url": None,
+            "default_example": None, "latest_version": None,
+        }
+
+    def _version_json(self, version_id):
+        return {
+            "id": version_id, "created_at": "2024-01-01T00:00:00Z",
+            "cog_version": "0.9.0", "openapi_schema": {},
+        }
+
+    def _prediction_json(self, prediction):
+        # Predictions complete once their latency has elapsed
+        if prediction["status"] == "starting" and time.time() >= prediction["ready_at"]:
+            if prediction["fail"]:
+                prediction["status"] = "failed"
+                prediction["error"] = "Injected failure"
+            else:
+                prediction["status"] = "succeeded"
+                kind = "mp4" if "input_image" in (prediction["input"] or {}) else "png"
+                output_name = f"{prediction['id']}.{kind}"
+                self.state.outputs[output_name] = self.state.payload(kind)
+                output_url = f"{self.base_url}/outputs/{output_name}"
+                prediction["output"] = output_url if kind == "mp4" else [output_url]
+
+        return {
+            "id": prediction["id"], "model": "stub/model", "version": prediction["version"],
+            "status": prediction["status"], "input": prediction["input"], "output": prediction["output"],
+            "logs": "", "error": prediction["error"], "metrics": {},
+            "created_at": "2024-01-01T00:00:00Z", "started_at": None, "completed_at": None,
+            "urls": {
+                "get": f"{self.base_url}/v1/predictions/{prediction['id']}",
+                "cancel": f"{self.base_url}/v1/predictions/{prediction['id']}/cancel",
+            },
+        }
+
+    def _create_prediction(self):
+        body = json.loads(self._read_body() or b"{}")
+        prediction = {
+            "id": uuid.uuid4().hex, "version": body.get("version", ""), "input": body.get("input"),
+            "status": "starting", "output": None, "error": None,
+            "ready_at": time.time() + self.state.latency(), "fail": self.state.should_fail(),
+        }
+        with self.state.lock:
+            self.state.predictions[prediction["id"]] = prediction
+        self._send(201, self._prediction_json(prediction))
+
+    def _create_file(self):
+        self._read_body()
+        file_id = uuid.uuid4().hex
+        self._send(201, {
+            "id": file_id, "name": "upload", "content_type": "application/octet-stream", "size": 0,
+            "etag": file_id, "checksums": {}, "metadata": {}, "created_at": "2024-01-01T00:00:00Z",
+            "expires_at": None, "urls": {"get": f"{self.base_url}/v1/files/{file_id}"},
+        })
+
+    def _serve_output(self, name):
+        data = self.state.outputs.get(name)
+        if data is None:
+            self._send(404, {"detail": "Not found"})
+            return
+
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            self._send(206, data[start:], content_type="application/octet-stream",
+                       headers={"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"})
+        else:
+            self._send(200, data, content_type="application/octet-stream")
+
+    # Routing
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "outputs" and len(parts) == 2:
+            self._serve_output(parts[1])
+        elif parts[:2] == ["v1", "models"] and len(parts) == 4:
+            self._send(200, self._model_json(parts[2], parts[3]))
+        elif parts[:2] == ["v1", "models"] and len(parts) == 6 and parts[4] == "versions":
+            self._send(200, self._version_json(parts[5]))
+        elif parts[:2] == ["v1", "predictions"] and len(parts) == 3:
+            prediction = self.state.predictions.get(parts[2])
+            if prediction is None:
+                self._send(404, {"detail": "Not found"})
+            else:
+                self._send(200, self._prediction_json(prediction))
+        else:
+            self._send(404, {"detail": "Not found"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "models":
+            self._hf_generate()
+        elif parts == ["__config"]:
+            self.state.config.update(json.loads(self._read_body() or b"{}"))
+            self._send(200, self.state.config)
+        elif parts == ["v1", "files"]:
+            self._create_file()
+        elif parts == ["v1", "predictions"]:
+            self._create_prediction()
+        elif parts[:2] == ["v1", "predictions"] and len(parts) == 4 and parts[3] == "cancel":
+            self._read_body()
+            prediction = self.state.predictions.get(parts[2])
+            if prediction is None:
+                self._send(404, {"detail": "Not found"})
+                return
+            prediction["status"] = "canceled"
+            self._send(200, self._prediction_json(prediction))
+        else:
+            self._read_body()
+            self._send(404, {"detail": "Not found"})
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """Start the stub server in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(config or {})
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the Hugging Face / Replicate stub server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=default_config["latency"])
+    parser.add_argument("--payload-kb", type=int, default=default_config["payload_bytes"] // 1024)
+    parser.add_argument("--error-rate", type=float, default=default_config["error_rate"])
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(
+        {"latency": args.latency, "payload_bytes": args.payload_kb * 1024, "error_rate": args.error_rate},
+        port=args.port
+    )
+    print(f"Stub server listening on {base_url}")
+    print(f"Use HF_INFERENCE_BASE_URL={base_url} and REPLICATE_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,75 @@
+import logging
+import os
+from functools import lru_cache
+
+from generation_cache import file_sha256
+from image_codec import encode_image, write_atomic
+import metrics
+
+logger = logging.getLogger(__name__)
+
+video_extensions = (".mp4", ".webm", ".mov")
+
+
+def is_video(path):
+    """Whether a history asset is a video rather than an image"""
+    return path.lower().endswith(video_extensions)
+
+
+# Memoized helpers are keyed by (path, mtime, size) so a changed file is looked at again
+@lru_cache(maxsize=4096)
+def _content_hash(path, mtime_ns, size):
+    return file_sha256(path)
+
+
+@lru_cache(maxsize=4096)
+def _verify(path, mtime_ns, size):
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            img.verify()
+        return None
+    except (OSError, Image.UnidentifiedImageError) as e:
+        return str(e)
+
+
+def content_hash(path):
+    """Return the SHA-256 of a file, hashing it only once per version of the file"""
+    stat = os.stat(path)
+    return _content_hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+def verify_image(path):
+    """
+    Check that a file is a readable image, remembering the answer per version of the file.
+    Returns None if the image is valid, otherwise an error message.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError as e:
+        return str(e)
+    return _verify(path, stat.st_mtime_ns, stat.st_size)
+
+
+def get_thumbnail(path, thumb_dir, max_size=(512, 512)):
+    """
+    Return the path of a thumbnail for an image, building it on first use.
+    Thumbnails are named by the content hash of the source, so each asset is only
+    resized once no matter how often it is displayed.
+    """
+    from PIL import Image
+
+    thumb_path = os.path.join(thumb_dir, f"{content_hash(path)}_{max_size[0]}x{max_size[1]}.webp")
+    if os.path.exists(thumb_path):
+        return thumb_path
+
+    os.makedirs(thumb_dir, exist_ok=True)
+    with metrics.timer("thumbnail"):
+        with Image.open(path) as img:
+            img.thumbnail(max_size)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            write_atomic(encode_image(img, "webp", quality=80), thumb_path)
+    logger.debug("Created thumbnail for %s", path)
+    return thumb_path
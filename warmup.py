@@ -0,0 +1,75 @@
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class ModelWarmer:
+    """
+    Background thread that keeps selected Hugging Face models loaded.
+    Each pass sends every model a minimal inference request: on a warm model it
+    resets the idle timer that would unload it, on a cold one it starts loading.
+    """
+
+    # Smallest request that keeps a model loaded, or makes the inference API load it
+    warmup_payload = {
+        "inputs": "warmup",
+        "parameters": {"num_inference_steps": 1, "width": 256, "height": 256},
+        "options": {"wait_for_model": False},
+    }
+
+    def __init__(self, model_urls, session, headers, interval=300, timeout=10):
+        self.model_urls = model_urls  # name -> inference URL
+        self.session = session
+        self.headers = headers
+        self.interval = interval
+        self.timeout = timeout
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def warm(self, name, api_url):
+        """Ping one model with the minimal request. Returns True if it was already loaded."""
+        try:
+            response = self.session.post(api_url, headers=self.headers, json=self.warmup_payload, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error warming model %s: %s", name, e)
+            return False
+
+        if response.ok:
+            logger.debug("Model %s is warm", name)
+            return True
+        if response.status_code == 503:
+            logger.info("Model %s is cold, loading started by warm-up request", name)
+        else:
+            logger.warning("Warm-up request for model %s failed with status %s", name, response.status_code)
+        return False
+
+    def run_once(self):
+        for name, api_url in self.model_urls.items():
+            if self._stop_event.is_set():
+                break
+            self.warm(name, api_url)
+
+    def start(self):
+        """Start warming models in a daemon thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.is_set():
+                self.run_once()
+                self._stop_event.wait(self.interval)
+
+        self._thread = threading.Thread(target=run, name="model-warmer", daemon=True)
+        self._thread.start()
+        logger.info("Started model warmer for: %s", ', '.join(self.model_urls))
+
+    def stop(self):
+        """Stop the warmer thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None